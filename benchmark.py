@@ -0,0 +1,220 @@
+from utils.utilbase import *
+import sat
+import gjk
+import epa
+import sha
+import argparse
+import csv
+import json
+import math
+import numpy as np
+import random
+import sys
+import time
+
+VERTEX_COUNTS = [3, 4, 8, 16, 32, 64, 128, 256]
+
+#The gap left between the two polygons along the direction B is slid out in, as a fraction of the narrower one's width
+#along it. Negative gaps are how far B is pushed back in past touching, so each class means the same at any vertex count
+OVERLAPS = {
+    'separated': 0.1,
+    'touching': 0.0,
+    'shallow': -0.1,
+    'deep': -0.5,
+}
+
+ALGORITHMS = ['sat', 'gjk', 'epa', 'sha']
+
+#Pairs per scenario, the bigger counts show up anything that doesn't scale linearly, like caches getting evicted
+PAIR_COUNTS = [10, 100, 500]
+
+def makeRandomPolygon(rng, numPoints, radius, origin):
+    """Makes a convex polygon by putting one point in each of numPoints equal slices of a circle, at a random angle
+    within the slice. The points go the same way round as the ones in the demos."""
+    poly = Polygon(origin, rng.uniform(0.0, 2.0 * math.pi))
+    angle = 2.0 * math.pi / numPoints
+    for i in range(0, -numPoints, -1):
+        theta = angle * (i + rng.uniform(-0.3, 0.3))
+        poly.addPoint(Vector(radius * math.cos(theta), radius * math.sin(theta)))
+    return poly
+
+def getExtent(points, directionX, directionY):
+    projections = points[:, 0] * directionX + points[:, 1] * directionY
+    return (projections.min(), projections.max())
+
+def getTouchingDistance(polyA, polyB, directionX, directionY):
+    """How far B has to be slid from A's origin along the direction for the two to just touch, with both starting at
+    the origin. That's where the ray along the direction leaves their Minkowski difference, whose edges all have normals
+    from A or B, so it's the least support gap over those normals divided by how much the direction points along them"""
+    (pointsA, pointsB) = (polyA.getTransformedArray(), polyB.getTransformedArray())
+    normals = np.concatenate((polyA.getEdgeNormalArray(), polyB.getEdgeNormalArray()))
+    normals = np.concatenate((normals, -normals))
+    along = normals @ (directionX, directionY)
+    normals = normals[along > 0.0]
+    #B's origin is at the origin, so its points are relative to where it gets slid from
+    gaps = (pointsA @ normals.T).max(axis=0) - ((pointsB - (polyB.origin.x, polyB.origin.y)) @ normals.T).min(axis=0)
+    return float((gaps / along[along > 0.0]).min())
+
+def checkOverlap(polyA, polyB, overlap):
+    """Makes sure a generated pair really is in its overlap class"""
+    (isColliding, depth, normal) = sat.SeparatingAxisTest(polyA, polyB).calculate()
+    scale = polyA.getBoundingRadius() + polyB.getBoundingRadius()
+
+    if overlap == 'separated':
+        assert not isColliding, "separated pair is colliding"
+    elif overlap == 'touching':
+        #Rounding leaves them a hair apart or a hair into each other, either way by next to nothing
+        assert not isColliding or depth <= 1e-9 * scale, "touching pair is overlapping by " + str(depth)
+        if not isColliding:
+            algorithm = gjk.GJKAlgorithm(polyA, polyB)
+            distance = algorithm.calculateDistance()[0]
+            assert distance <= algorithm.DISTANCE_TOLERANCE, "touching pair is " + str(distance) + " apart"
+    else:
+        assert isColliding and depth > 1e-9 * scale, overlap + " pair isn't overlapping"
+
+def makeScenario(seed, numPoints, overlap, numPairs):
+    """Makes pairs of polygons in an overlap class. A is put at the origin, and B is slid out along a random direction
+    to where they just touch, then moved on by the gap the class asks for"""
+    rng = random.Random(str(seed) + ":" + str(numPoints) + ":" + overlap)
+    pairs = []
+    for i in range(numPairs):
+        radiusA = rng.uniform(20.0, 80.0)
+        radiusB = rng.uniform(20.0, 80.0)
+        direction = rng.uniform(0.0, 2.0 * math.pi)
+        (directionX, directionY) = (math.cos(direction), math.sin(direction))
+        polyA = makeRandomPolygon(rng, numPoints, radiusA, Vector(0.0, 0.0))
+        polyB = makeRandomPolygon(rng, numPoints, radiusB, Vector(0.0, 0.0))
+
+        (minA, maxA) = getExtent(polyA.getTransformedArray(), directionX, directionY)
+        (minB, maxB) = getExtent(polyB.getTransformedArray(), directionX, directionY)
+        distance = getTouchingDistance(polyA, polyB, directionX, directionY) + OVERLAPS[overlap] * min(maxA - minA, maxB - minB)
+        polyB.origin = Vector(distance * directionX, distance * directionY)
+
+        checkOverlap(polyA, polyB, overlap)
+        pairs.append((polyA, polyB))
+    return pairs
+
+def runAlgorithm(algorithm, pairs, contacts):
+    if algorithm == 'sat':
+        for (polyA, polyB) in pairs:
+            sat.SeparatingAxisTest(polyA, polyB).calculate()
+    elif algorithm == 'gjk':
+        for (polyA, polyB) in pairs:
+            gjk.GJKAlgorithm(polyA, polyB).calculate()
+    elif algorithm == 'epa':
+        for (polyA, polyB) in pairs:
+            epa.ExpandingPolytopeAlgorithm(polyA, polyB).calculate()
+    elif algorithm == 'sha':
+        for (polyA, polyB, depth, normal) in contacts:
+            sha.SutherlandHodgemanAlgorithm(polyA, polyB, normal, depth).calculate()
+
+def timeAlgorithm(algorithm, pairs, repeat):
+    """Returns the best time of several runs. Every run starts with cold polygon caches, like a new frame after everything has moved"""
+    contacts = []
+    if algorithm == 'sha':
+        for (polyA, polyB) in pairs:
+            (isColliding, depth, normal) = sat.SeparatingAxisTest(polyA, polyB).calculate()
+            if isColliding:
+                contacts.append((polyA, polyB, depth, normal))
+
+    best = float('inf')
+    for i in range(repeat):
+        for (polyA, polyB) in pairs:
+            polyA.invalidate()
+            polyB.invalidate()
+
+        start = time.perf_counter()
+        runAlgorithm(algorithm, pairs, contacts)
+        best = min(best, time.perf_counter() - start)
+
+    return (best, len(contacts) if algorithm == 'sha' else len(pairs))
+
+def runBenchmarks(seed, vertexCounts, overlaps, algorithms, pairCounts, repeat):
+    """Times every algorithm on every scenario, one result per pair count. requestedPairs is the size of the scenario,
+    pairs is how many of them the algorithm actually ran on, which for clipping is only the colliding ones"""
+    results = []
+    for numPoints in vertexCounts:
+        for overlap in overlaps:
+            for numPairs in pairCounts:
+                pairs = makeScenario(seed, numPoints, overlap, numPairs)
+                for algorithm in algorithms:
+                    (seconds, count) = timeAlgorithm(algorithm, pairs, repeat)
+                    results.append({
+                        'algorithm': algorithm,
+                        'vertices': numPoints,
+                        'overlap': overlap,
+                        'requestedPairs': numPairs,
+                        'pairs': count,
+                        'seconds': seconds,
+                        'usPerPair': seconds * 1e6 / count if count > 0 else 0.0,
+                    })
+    return results
+
+def getKey(result):
+    #Baselines from before the pair count sweep have no requestedPairs, so they only match results that have none either
+    return (result['algorithm'], result['vertices'], result['overlap'], result.get('requestedPairs'))
+
+def compareToBaseline(results, baseline, threshold):
+    """Returns the results whose time per pair is more than threshold (a fraction) slower than the baseline"""
+    baselineByKey = {getKey(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baselineByKey.get(getKey(result))
+        if old is None or old['usPerPair'] == 0.0:
+            continue
+        ratio = result['usPerPair'] / old['usPerPair']
+        if ratio > 1.0 + threshold:
+            regressions.append((result, old, ratio))
+    return regressions
+
+def writeResults(results, outputFile, outputFormat):
+    if outputFormat == 'json':
+        json.dump({'results': results}, outputFile, indent=2)
+        outputFile.write('\n')
+    else:
+        writer = csv.DictWriter(outputFile, fieldnames=['algorithm', 'vertices', 'overlap', 'requestedPairs', 'pairs', 'seconds', 'usPerPair'])
+        writer.writeheader()
+        writer.writerows(results)
+
+def readResults(path):
+    with open(path, newline='') as inputFile:
+        if path.endswith('.csv'):
+            return [{'algorithm': row['algorithm'], 'vertices': int(row['vertices']), 'overlap': row['overlap'],
+                'requestedPairs': int(row['requestedPairs']) if row.get('requestedPairs') else None, 'pairs': int(row['pairs']),
+                'seconds': float(row['seconds']), 'usPerPair': float(row['usPerPair'])} for row in csv.DictReader(inputFile)]
+        return json.load(inputFile)['results']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times SAT, GJK, EPA and Sutherland-Hodgman on seeded random convex polygons")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairs', type=int, nargs='+', default=PAIR_COUNTS, help="numbers of polygon pairs per scenario to sweep over")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per scenario, the fastest one is reported")
+    parser.add_argument('--vertices', type=int, nargs='+', default=VERTEX_COUNTS)
+    parser.add_argument('--overlaps', nargs='+', choices=list(OVERLAPS), default=list(OVERLAPS))
+    parser.add_argument('--algorithms', nargs='+', choices=ALGORITHMS, default=ALGORITHMS)
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--output', help="file to write the results to, defaults to stdout")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.seed, args.vertices, args.overlaps, args.algorithms, args.pairs, args.repeat)
+
+    if args.output is None:
+        writeResults(results, sys.stdout, args.format)
+    else:
+        with open(args.output, 'w', newline='') as outputFile:
+            writeResults(results, outputFile, args.format)
+
+    if args.baseline is not None:
+        regressions = compareToBaseline(results, readResults(args.baseline), args.threshold)
+        for (result, old, ratio) in regressions:
+            sys.stderr.write("Regression: " + result['algorithm'] + " " + str(result['vertices']) + " vertices " + result['overlap'] +
+                " " + str(result['requestedPairs']) + " pairs " + str(round(old['usPerPair'], 2)) + "us -> " + str(round(result['usPerPair'], 2)) + "us (" + str(round(ratio, 2)) + "x)\n")
+        if len(regressions) > 0:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,435 @@
+from utils.utilbase import *
+import epa
+import math
+import random
+
+class TreeNode:
+    def __init__(self, aabb, poly=None):
+        self.aabb = aabb
+        self.poly = poly
+        self.parent = None
+        self.child1 = None
+        self.child2 = None
+        self.height = 0
+    def isLeaf(self):
+        return self.child1 is None
+
+class DynamicAABBTree:
+    """ A bounding volume hierarchy of polygons that can be changed on the fly. The leaves store a "fat" bounding box, which is the polygon's bounding box grown by a margin, so a polygon can move around a bit inside its fat box without the tree having to change. When it does escape, it gets taken out and reinserted. New leaves are placed next to the sibling that grows the total perimeter of the tree the least, and the tree is kept balanced with rotations on the way back up, like an AVL tree. """
+    def __init__(self, margin=5.0):
+        self.root = None
+        self.margin = margin
+
+    def __balance(self, A):
+        """Rotates the taller grandchild of A up if its children differ in height by more than one, returns the new root of the subtree"""
+        if A.isLeaf() or A.height < 2:
+            return A
+
+        B = A.child1
+        C = A.child2
+        balance = C.height - B.height
+
+        if balance > 1:
+            #C is too tall, so C takes A's place and A takes whichever of C's children is shorter
+            F = C.child1
+            G = C.child2
+
+            C.child1 = A
+            C.parent = A.parent
+            A.parent = C
+            self.__replaceChild(C.parent, A, C)
+
+            if F.height > G.height:
+                C.child2 = F
+                A.child2 = G
+                G.parent = A
+            else:
+                C.child2 = G
+                A.child2 = F
+                F.parent = A
+
+            self.__refit(A)
+            self.__refit(C)
+            return C
+
+        if balance < -1:
+            #Same thing, but B is too tall
+            D = B.child1
+            E = B.child2
+
+            B.child1 = A
+            B.parent = A.parent
+            A.parent = B
+            self.__replaceChild(B.parent, A, B)
+
+            if D.height > E.height:
+                B.child2 = D
+                A.child1 = E
+                E.parent = A
+            else:
+                B.child2 = E
+                A.child1 = D
+                D.parent = A
+
+            self.__refit(A)
+            self.__refit(B)
+            return B
+
+        return A
+
+    def __replaceChild(self, parent, oldChild, newChild):
+        if parent is None:
+            self.root = newChild
+        elif parent.child1 is oldChild:
+            parent.child1 = newChild
+        else:
+            parent.child2 = newChild
+
+    def __refit(self, node):
+        node.aabb = node.child1.aabb.union(node.child2.aabb)
+        node.height = 1 + max(node.child1.height, node.child2.height)
+
+    def __refitAncestors(self, node):
+        while node is not None:
+            node = self.__balance(node)
+            self.__refit(node)
+            node = node.parent
+
+    def __insertLeaf(self, leaf):
+        if self.root is None:
+            self.root = leaf
+            leaf.parent = None
+            return
+
+        #Walk down the tree picking the child that is cheapest to put the leaf under, where the cost is the perimeter
+        #of the new parent node plus how much every ancestor has to grow to fit the leaf
+        sibling = self.root
+        while not sibling.isLeaf():
+            perimeter = sibling.aabb.getPerimeter()
+            combinedPerimeter = sibling.aabb.union(leaf.aabb).getPerimeter()
+
+            cost = 2.0 * combinedPerimeter
+            inheritanceCost = 2.0 * (combinedPerimeter - perimeter)
+
+            childCosts = []
+            for child in (sibling.child1, sibling.child2):
+                childCost = child.aabb.union(leaf.aabb).getPerimeter() + inheritanceCost
+                if not child.isLeaf():
+                    childCost -= child.aabb.getPerimeter()
+                childCosts.append(childCost)
+
+            if cost < childCosts[0] and cost < childCosts[1]:
+                break
+
+            sibling = sibling.child1 if childCosts[0] < childCosts[1] else sibling.child2
+
+        oldParent = sibling.parent
+        newParent = TreeNode(sibling.aabb.union(leaf.aabb))
+        newParent.parent = oldParent
+        newParent.child1 = sibling
+        newParent.child2 = leaf
+        newParent.height = sibling.height + 1
+        sibling.parent = newParent
+        leaf.parent = newParent
+        self.__replaceChild(oldParent, sibling, newParent)
+
+        self.__refitAncestors(oldParent)
+
+    def __removeLeaf(self, leaf):
+        if leaf is self.root:
+            self.root = None
+            return
+
+        parent = leaf.parent
+        grandParent = parent.parent
+        sibling = parent.child2 if parent.child1 is leaf else parent.child1
+
+        #The sibling takes the parent's place
+        sibling.parent = grandParent
+        self.__replaceChild(grandParent, parent, sibling)
+        leaf.parent = None
+
+        self.__refitAncestors(grandParent)
+
+    def insert(self, poly):
+        """Adds a polygon to the tree and returns its leaf node, which is needed to move or remove it"""
+        leaf = TreeNode(poly.getAABB().getFattened(self.margin), poly)
+        self.__insertLeaf(leaf)
+        return leaf
+
+    def remove(self, leaf):
+        self.__removeLeaf(leaf)
+
+    def move(self, leaf):
+        """Call after moving a polygon. Returns True if it left its fat bounding box and had to be reinserted"""
+        aabb = leaf.poly.getAABB()
+        if leaf.aabb.contains(aabb):
+            return False
+
+        self.__removeLeaf(leaf)
+        leaf.aabb = aabb.getFattened(self.margin)
+        self.__insertLeaf(leaf)
+        return True
+
+    def getHeight(self):
+        return 0 if self.root is None else self.root.height
+
+    def query(self, aabb):
+        """Returns every polygon whose fat bounding box overlaps the given box"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+
+        while len(stack) > 0:
+            node = stack.pop()
+            if not node.aabb.overlaps(aabb):
+                continue
+            if node.isLeaf():
+                results.append(node.poly)
+            else:
+                stack.append(node.child1)
+                stack.append(node.child2)
+
+        return results
+
+    def queryPoint(self, point):
+        """Returns every polygon whose fat bounding box contains the point"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+
+        while len(stack) > 0:
+            node = stack.pop()
+            if not node.aabb.containsPoint(point):
+                continue
+            if node.isLeaf():
+                results.append(node.poly)
+            else:
+                stack.append(node.child1)
+                stack.append(node.child2)
+
+        return results
+
+    def rayCast(self, start, end, maxFraction=1.0):
+        """Returns (polygon, fraction, normal) for the closest polygon the ray from start to end hits, or None.
+        Every hit shortens the ray, so any box it no longer reaches is skipped along with everything under it"""
+        delta = end - start
+        best = None
+        stack = []
+        if self.root is not None:
+            stack.append((0.0, self.root))
+
+        while len(stack) > 0:
+            (entry, node) = stack.pop()
+            #A closer hit may have been found since this node was pushed
+            if entry > maxFraction:
+                continue
+
+            if node.isLeaf():
+                if node.poly.getAABB().rayCast(start, delta, maxFraction) is None:
+                    continue
+                hit = node.poly.rayCast(start, end, maxFraction)
+                if hit is not None:
+                    maxFraction = hit[0]
+                    best = (node.poly, hit[0], hit[1])
+                continue
+
+            #The nearer child goes on the stack last so it's looked at first, and finds the close hits early
+            entry1 = node.child1.aabb.rayCast(start, delta, maxFraction)
+            entry2 = node.child2.aabb.rayCast(start, delta, maxFraction)
+            if entry1 is not None and entry2 is not None:
+                if entry1 < entry2:
+                    stack.append((entry2, node.child2))
+                    stack.append((entry1, node.child1))
+                else:
+                    stack.append((entry1, node.child1))
+                    stack.append((entry2, node.child2))
+            elif entry1 is not None:
+                stack.append((entry1, node.child1))
+            elif entry2 is not None:
+                stack.append((entry2, node.child2))
+
+        return best
+
+    def __crossPairs(self, stack):
+        #Descends two subtrees at once, only going further while their boxes overlap
+        while len(stack) > 0:
+            (nodeA, nodeB) = stack.pop()
+            if not nodeA.aabb.overlaps(nodeB.aabb):
+                continue
+
+            if nodeA.isLeaf() and nodeB.isLeaf():
+                yield (nodeA.poly, nodeB.poly)
+            elif nodeB.isLeaf() or (not nodeA.isLeaf() and nodeA.height >= nodeB.height):
+                stack.append((nodeA.child1, nodeB))
+                stack.append((nodeA.child2, nodeB))
+            else:
+                stack.append((nodeA, nodeB.child1))
+                stack.append((nodeA, nodeB.child2))
+
+    def queryPairs(self):
+        """Yields every pair of polygons in this tree whose fat boxes overlap. Two leaves can only meet under
+        the node where their paths from the root split, so we cross the two children of every internal node"""
+        nodes = [self.root] if self.root is not None else []
+
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if node.isLeaf():
+                continue
+
+            nodes.append(node.child1)
+            nodes.append(node.child2)
+            yield from self.__crossPairs([(node.child1, node.child2)])
+
+    def queryTreePairs(self, other):
+        """Yields every pair (polygon from this tree, polygon from the other tree) whose fat boxes overlap"""
+        if self.root is None or other.root is None:
+            return
+
+        yield from self.__crossPairs([(self.root, other.root)])
+
+class AABBTreeBroadPhase:
+    """ A broad phase for worlds with lots of static geometry and comparatively few moving bodies. Static and dynamic polygons go into separate trees, so the static tree never has to be refitted and static polygons are never paired with each other. Candidate pairs come from the dynamic tree against itself and the dynamic tree against the static one, and are filtered by their real bounding boxes before they're handed to the narrow phase. """
+    def __init__(self, margin=5.0):
+        self.staticTree = DynamicAABBTree(0.0)
+        self.dynamicTree = DynamicAABBTree(margin)
+        self.__leaves = {}
+
+    def __len__(self):
+        return len(self.__leaves)
+
+    def __contains__(self, poly):
+        return poly in self.__leaves
+
+    def __iter__(self):
+        return iter(self.__leaves)
+
+    def insert(self, poly, isStatic=False):
+        tree = self.staticTree if isStatic else self.dynamicTree
+        self.__leaves[poly] = (tree.insert(poly), tree)
+
+    def remove(self, poly):
+        (leaf, tree) = self.__leaves.pop(poly)
+        tree.remove(leaf)
+
+    def move(self, poly):
+        """Updates a single polygon, static polygons that get moved must be passed in here since update skips them"""
+        (leaf, tree) = self.__leaves[poly]
+        return tree.move(leaf)
+
+    def update(self):
+        """Updates every dynamic polygon, returns the number that had to be reinserted"""
+        numReinserted = 0
+        for (leaf, tree) in self.__leaves.values():
+            if tree is self.dynamicTree and tree.move(leaf):
+                numReinserted += 1
+        return numReinserted
+
+    def rayCast(self, start, end):
+        """Casts a ray against every polygon, static and dynamic, and returns (polygon, fraction, normal, point) for the
+        closest hit, or None. Rays that start inside a polygon don't hit it"""
+        best = self.dynamicTree.rayCast(start, end)
+        #The static tree only needs to look closer than whatever the dynamic tree hit
+        staticHit = self.staticTree.rayCast(start, end, 1.0 if best is None else best[1])
+        if staticHit is not None:
+            best = staticHit
+
+        if best is None:
+            return None
+
+        (poly, fraction, normal) = best
+        return (poly, fraction, normal, start + (end - start) * fraction)
+
+    def queryPoint(self, point):
+        """Returns every polygon that contains the point"""
+        return [poly for poly in self.dynamicTree.queryPoint(point) + self.staticTree.queryPoint(point) if poly.containsPoint(point)]
+
+    def queryRegion(self, aabb):
+        """Returns every polygon that overlaps the region, not just the ones whose bounding box does"""
+        return [poly for poly in self.dynamicTree.query(aabb) + self.staticTree.query(aabb) if poly.overlapsAABB(aabb)]
+
+    def getCandidatePairs(self):
+        for (polyA, polyB) in self.dynamicTree.queryPairs():
+            if polyA.getAABB().overlaps(polyB.getAABB()):
+                yield (polyA, polyB)
+
+        for (polyA, polyB) in self.dynamicTree.queryTreePairs(self.staticTree):
+            if polyA.getAABB().overlaps(polyB.getAABB()):
+                yield (polyA, polyB)
+
+if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
+    random.seed(1)
+    broadPhase = AABBTreeBroadPhase(8.0)
+    velocities = {}
+
+    #A static floor and some walls made out of boxes, which all share the same shape
+    blockShape = ConvexShape([[-25.0, -25.0], [-25.0, 25.0], [25.0, 25.0], [25.0, -25.0]])
+    for k in range(16):
+        for (x, y) in [(25 + 50 * k, 575), (25, 25 + 50 * k), (775, 25 + 50 * k)]:
+            broadPhase.insert(Polygon.fromShape(blockShape, Vector(x, y)), True)
+
+    for k in range(40):
+        poly = Polygon(Vector(random.uniform(100, 700), random.uniform(100, 500)), random.uniform(0, 2.0 * math.pi))
+        numPoints = random.randint(3, 8)
+        angle = 2.0 * math.pi / numPoints
+        radius = random.uniform(10, 30)
+        for i in range(0, -numPoints, -1):
+            poly.addPoint(Vector(radius * math.cos(angle * i), radius * math.sin(angle * i)))
+
+        broadPhase.insert(poly)
+        velocities[poly] = Vector(random.uniform(-1.5, 1.5), random.uniform(-1.5, 1.5))
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Dynamic AABB Tree Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        for (poly, velocity) in velocities.items():
+            poly.origin += velocity
+            poly.rotation += 0.01
+            if poly.origin.x < 50 or poly.origin.x > 750:
+                velocity.x *= -1.0
+            if poly.origin.y < 50 or poly.origin.y > 550:
+                velocity.y *= -1.0
+
+        numReinserted = broadPhase.update()
+
+        colliding = set()
+        for (polyA, polyB) in broadPhase.getCandidatePairs():
+            (isColliding, penetrationDepth, normal_vector) = epa.ExpandingPolytopeAlgorithm(polyA, polyB).calculate()
+            if isColliding:
+                colliding.add(polyA)
+                colliding.add(polyB)
+
+        screen.fill((0, 0, 0))
+        for poly in broadPhase:
+            drawPolygon(screen, poly, color = (255, 0, 0) if poly in colliding else (255, 255, 255))
+
+        #A ray from the middle of the screen to the mouse, stopped at the first thing it hits
+        rayStart = Vector(400.0, 300.0)
+        rayEnd = Vector(*pygame.mouse.get_pos())
+        hit = broadPhase.rayCast(rayStart, rayEnd)
+        if hit is not None:
+            (hitPoly, fraction, hitNormal, hitPoint) = hit
+            drawLine(screen, rayStart, hitPoint)
+            drawLine(screen, hitPoint, hitPoint + hitNormal * 20.0, color=(0, 0, 255))
+        else:
+            drawLine(screen, rayStart, rayEnd)
+
+        infoText = font.render("Tree height " + str(broadPhase.dynamicTree.getHeight()) + " Reinserted " + str(numReinserted), True, (255, 255, 255))
+        screen.blit(infoText, (450, 520))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
@@ -0,0 +1,151 @@
+from utils.utilbase import *
+import gjk
+import time
+
+class ConservativeAdvancement:
+    """ Finds the time of impact of two polygons moving from one transform to another over a step, so fast moving polygons can't tunnel through thin ones. Each transform is an (origin, rotation) tuple, and both are interpolated linearly with time going from 0 to 1. At each iteration we get the distance between the polygons with GJK, then work out the fastest they could possibly be closing on each other along the separating direction - their relative velocity along it, plus the fastest any point could be swinging round because of the rotation, which is the angular speed times the bounding radius. Moving forward in time by distance / speed can't make them overlap, so we do that until they're within tolerance of touching, or we run past the end of the step. The polygons are moved around while this runs, but are put back where they were afterwards. """
+    def __init__(self, polyA, polyB, startA, endA, startB, endB, metrics=None):
+        self.polygonA = polyA
+        self.polygonB = polyB
+        self.startA = startA
+        self.endA = endA
+        self.startB = startB
+        self.endB = endB
+        self.TOLERANCE = 0.01
+        self.MAX_ITERATIONS = 32
+        self.metrics = metrics
+        self.numIterations = 0
+        #Filled in by calculate, if this is set the hit is unconverged - the polygons were still closing in but hadn't been
+        #seen touching, and the time of impact is just the furthest we could safely get
+        self.hitIterationLimit = False
+
+    def __moveTo(self, t):
+        for (poly, start, end) in [(self.polygonA, self.startA, self.endA), (self.polygonB, self.startB, self.endB)]:
+            poly.origin = start[0] + (end[0] - start[0]) * t
+            poly.rotation = start[1] + (end[1] - start[1]) * t
+
+    def calculate(self):
+        """Returns (isHit, timeOfImpact, normal), where the normal points from A to B. If they're already overlapping at
+        the start the time is 0 and there's no normal, and if they never touch we return (False, 1.0, None). If we run
+        out of iterations the hit is unconverged and hitIterationLimit is set. It's still reported as a hit, since the time
+        is a safe place to stop them and reporting a miss would let them tunnel, but the contact was never confirmed"""
+        self.hitIterationLimit = False
+
+        if self.metrics is None:
+            return self.__calculate()
+
+        start = time.perf_counter()
+        result = self.__calculate()
+        self.metrics.record('ccd', time.perf_counter() - start, {'iterations': self.numIterations})
+        if self.hitIterationLimit:
+            self.metrics.flag('ccd', 'iteration_limit', self.polygonA, self.polygonB)
+        return result
+
+    def __calculate(self):
+        savedA = (self.polygonA.origin, self.polygonA.rotation)
+        savedB = (self.polygonB.origin, self.polygonB.rotation)
+
+        velocityA = self.endA[0] - self.startA[0]
+        velocityB = self.endB[0] - self.startB[0]
+        relativeVelocity = velocityA - velocityB
+        angularBound = abs(self.endA[1] - self.startA[1]) * self.polygonA.getBoundingRadius() + abs(self.endB[1] - self.startB[1]) * self.polygonB.getBoundingRadius()
+
+        #We stop a little short of touching, if we went all the way there'd be no separating direction left to report
+        target = self.TOLERANCE * 0.5
+        t = 0.0
+        self.numIterations = 0
+
+        try:
+            while self.numIterations < self.MAX_ITERATIONS:
+                self.numIterations += 1
+                self.__moveTo(t)
+
+                (distance, closestA, closestB, normal) = gjk.GJKAlgorithm(self.polygonA, self.polygonB).calculateDistance()
+
+                if normal is None:
+                    return (True, t, None)
+
+                if distance <= self.TOLERANCE:
+                    return (True, t, normal)
+
+                closingSpeed = relativeVelocity.dot(normal) + angularBound
+                if closingSpeed <= 0.0:
+                    return (False, 1.0, None)
+
+                t += (distance - target) / closingSpeed
+                if t > 1.0:
+                    return (False, 1.0, None)
+
+            #Ran out of iterations while still closing in. They haven't been seen touching, but the current time is a safe
+            #lower bound, so it's reported as an unconverged hit rather than a miss
+            self.hitIterationLimit = True
+            return (True, t, normal)
+        finally:
+            (self.polygonA.origin, self.polygonA.rotation) = savedA
+            (self.polygonB.origin, self.polygonB.rotation) = savedB
+
+if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
+    wall = Polygon(Vector(400.0, 300.0))
+    wall.addPoint(Vector(-4.0, -150.0))
+    wall.addPoint(Vector(-4.0, 150.0))
+    wall.addPoint(Vector(4.0, 150.0))
+    wall.addPoint(Vector(4.0, -150.0))
+
+    bullet = Polygon(Vector(150.0, 300.0))
+    bullet.addPoint(Vector(-15.0, -5.0))
+    bullet.addPoint(Vector(-15.0, 5.0))
+    bullet.addPoint(Vector(15.0, 5.0))
+    bullet.addPoint(Vector(15.0, -5.0))
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Conservative Advancement Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    #The bullet covers this much ground in a single step, far more than the width of the wall
+    stepVelocity = Vector(180.0, 20.0)
+    stepSpin = 1.5
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        keys = pygame.key.get_pressed()
+        bullet.origin += Vector(keys[pygame.K_RIGHT] - keys[pygame.K_LEFT], keys[pygame.K_DOWN] - keys[pygame.K_UP]) * 2.0
+
+        start = (bullet.origin, bullet.rotation)
+        end = (bullet.origin + stepVelocity, bullet.rotation + stepSpin)
+        still = (wall.origin, wall.rotation)
+
+        advancement = ConservativeAdvancement(bullet, wall, start, end, still, still)
+        (isHit, timeOfImpact, normal) = advancement.calculate()
+
+        screen.fill((0, 0, 0))
+        drawPolygon(screen, wall)
+        drawPolygon(screen, bullet)
+
+        #Where the bullet ends the step, and where it would have been stopped
+        (bullet.origin, bullet.rotation) = end
+        drawPolygon(screen, bullet, color = (80, 80, 80))
+        if isHit:
+            bullet.origin = start[0] + stepVelocity * timeOfImpact
+            bullet.rotation = start[1] + stepSpin * timeOfImpact
+            #Orange if it ran out of iterations and the contact was never confirmed
+            drawPolygon(screen, bullet, color = (255, 0, 0) if not advancement.hitIterationLimit else (255, 160, 0))
+        (bullet.origin, bullet.rotation) = start
+
+        toiText = font.render("Time of impact " + (str(round(timeOfImpact, 3)) if isHit else "none"), True, (255, 255, 255))
+        screen.blit(toiText, (500, 560))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
@@ -1,64 +1,119 @@
 import gjk
+import heapq
+import time
 from utils.utilbase import *
 
 class ExpandingPolytopeAlgorithm(gjk.GJKAlgorithm):
-    def __init__(self, polyA, polyB):
-        super().__init__(polyA, polyB)
+    def __init__(self, polyA, polyB, cache=None, metrics=None):
+        super().__init__(polyA, polyB, cache, metrics)
         self.TOLERANCE = 0.001
-    def calculate(self):
-        """ We are going to use the simplex left over from a successful run of GJK to calculate the collision normal and penetration depth. A simplex is a regular polytope, so that makes our life a lot easier. If there is no collision from the GJK phase, we return false. """
+        self.MAX_EXPANSIONS = 64
 
-        result = super().calculate()
+        #After calculate this is one of 'separated', 'converged', 'iteration_limit' or 'degenerate'
+        self.terminationReason = None
+        self.numExpansions = 0
 
-        if result == False:
-            return (False, 0, Vector(0.0, 0.0))
+    def __makeEdge(self, vertI, vertJ):
+        """Works out the outward normal of the polytope edge from vertI to vertJ and its distance from the origin"""
+        #Worked out on the coordinates so the only vector we make is the normal we hand back
+        normalX = vertJ.y - vertI.y
+        normalY = vertI.x - vertJ.x
+        length = math.sqrt(normalX * normalX + normalY * normalY)
 
-        #Turn our simplex into a polytope
-        polytope = self.final_simplex[:]
+        #Two support points landed on top of each other, this edge has no direction so it can't be expanded
+        if length == 0.0:
+            return None
 
-        minIndex = 0
-        minDistance = float("inf")
-        minNormal = None
+        normalX /= length
+        normalY /= length
+        distance = normalX * vertI.x + normalY * vertI.y
 
-        #Find the closest edge to the origin
-        #Get its normal
-        #Get the support point corresponding to that normal
-        while minDistance == float('inf'):
+        if(distance < 0):
+            distance *= -1.0
+            normalX = -normalX
+            normalY = -normalY
 
-            for i in range(len(polytope)):
-                j = (i + 1) % len(polytope)
+        normal = Vector(normalX, normalY)
+        return (distance, normal)
 
-                vertI = Vector(polytope[i].x, polytope[i].y)
-                vertJ = Vector(polytope[j].x, polytope[j].y)
+    def calculate(self):
+        """ We are going to use the simplex left over from a successful run of GJK to calculate the collision normal and penetration depth. A simplex is a regular polytope, so that makes our life a lot easier. If there is no collision from the GJK phase, we return false. The edges of the polytope are kept in a heap ordered by their distance to the origin, so the closest one is always on top. Each expansion pops it, gets the support point along its normal and replaces it with the two edges joining its ends to that point - the rest of the polytope doesn't change, so those are the only normals we need to work out. """
 
-                ijvec = vertJ - vertI
+        self.numExpansions = 0
 
-                normal = Vector(ijvec.y, -ijvec.x)
-                normal.normalize()
-                distance = normal.dot(vertI)
+        if self.metrics is None:
+            return self.__calculate()
 
-                if(distance < 0):
-                    distance *= -1.0
-                    normal = normal * -1.0
+        #The time includes the GJK run at the start, which GJKAlgorithm.calculate records on its own as well
+        start = time.perf_counter()
+        result = self.__calculate()
+        self.metrics.record('epa', time.perf_counter() - start, {'expansions': self.numExpansions, 'supportCalls': self.numSupportCalls})
+        if self.terminationReason in ('iteration_limit', 'degenerate'):
+            self.metrics.flag('epa', self.terminationReason, self.polygonA, self.polygonB)
+        return result
 
-                if(distance < minDistance):
-                    #print("New min dist " + str(distance) + " " + str(normal) + " old was " + str(minDistance))
-                    minDistance = distance
-                    minNormal = normal
-                    minIndex = j
+    def __calculate(self):
+        result = super().calculate()
+
+        if result == False:
+            self.terminationReason = 'separated'
+            return (False, 0, Vector(0.0, 0.0))
+
+        #Turn our simplex into a polytope, each heap entry is (distance, tiebreaker, normal, start vertex, end vertex)
+        polytope = self.final_simplex
+        edges = []
+        counter = 0
+
+        for i in range(len(polytope)):
+            j = (i + 1) % len(polytope)
+            edge = self.__makeEdge(polytope[i], polytope[j])
+            if edge is not None:
+                edges.append((edge[0], counter, edge[1], polytope[i], polytope[j]))
+                counter += 1
+
+        heapq.heapify(edges)
+
+        if len(edges) == 0:
+            self.terminationReason = 'degenerate'
+            return (True, 0, Vector(0.0, 0.0))
+
+        while True:
+            #Find the closest edge to the origin
+            #Get its normal
+            #Get the support point corresponding to that normal
+            (minDistance, tiebreaker, minNormal, vertI, vertJ) = heapq.heappop(edges)
 
             supportPoint = support(self.polygonA, self.polygonB, minNormal)
+            self.numSupportCalls += 1
             supportDistance = minNormal.dot(supportPoint)
 
             #If the distance of the support point along the normal and the distance of the edge from the normal are within tolerance
-            #the algorithm is done. Otherwise, we insert that point into our polytope and go again.
-            if(abs(supportDistance - minDistance) > self.TOLERANCE):
-                minDistance = float('inf')
-                polytope.insert(minIndex, supportPoint)
-        
-        return (True, minDistance + self.TOLERANCE, minNormal)
+            #the algorithm is done. Otherwise, we split the edge at that point and go again.
+            if(abs(supportDistance - minDistance) <= self.TOLERANCE):
+                self.terminationReason = 'converged'
+                return (True, minDistance + self.TOLERANCE, minNormal)
+
+            if self.numExpansions >= self.MAX_EXPANSIONS:
+                #Best guess so far, the closest edge is never further away than the real answer
+                self.terminationReason = 'iteration_limit'
+                return (True, minDistance + self.TOLERANCE, minNormal)
+
+            self.numExpansions += 1
+
+            for (start, end) in [(vertI, supportPoint), (supportPoint, vertJ)]:
+                edge = self.__makeEdge(start, end)
+                if edge is not None:
+                    heapq.heappush(edges, (edge[0], counter, edge[1], start, end))
+                    counter += 1
+
+            if len(edges) == 0:
+                self.terminationReason = 'degenerate'
+                return (True, minDistance + self.TOLERANCE, minNormal)
  
 if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
     polyA = Polygon(Vector(165.0, 175.0))
     polyA.addPoint(Vector(0.0, -60.0))
     polyA.addPoint(Vector(-60.0, 60.0))
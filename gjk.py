@@ -1,36 +1,110 @@
 from utils.utilbase import *
 import math
-import pygame
+import time
+
+class GJKCache(PairCache):
+    """ Remembers how the last GJK query on each pair of polygons ended, so the next query on that pair can start from there. For a separated pair we keep the direction that separated them, and for an overlapping pair we keep the three directions that produced the final simplex. Since things don't move much between frames, the cached answer is usually still right, and checking it only takes one support call (separated) or three (overlapping). """
+    def store(self, polyA, polyB, separatingDirection=None, simplexDirections=None):
+        super().store(polyA, polyB, (separatingDirection, simplexDirections))
 
 class GJKAlgorithm:
-    def __init__(self, polyA, polyB):
+    def __init__(self, polyA, polyB, cache=None, metrics=None):
         self.polygonA = polyA
         self.polygonB = polyB
         self.final_simplex = None
+        self.cache = cache
+        self.metrics = metrics
+        self.MAX_ITERATIONS = 30
+        self.DISTANCE_TOLERANCE = 0.0001
+
+        #Filled in by calculate, if this is set GJK never found a separating direction but never enclosed the origin
+        #either, so the result is reported as a collision on the strength of the last simplex
+        self.hitIterationLimit = False
+        self.numIterations = 0
+        self.numSupportCalls = 0
+
+    def __warmStart(self, entry):
+        """Checks whether the cached result still holds, returns None if it doesn't and we need to run the full algorithm"""
+        (separatingDirection, simplexDirections) = entry
+
+        if separatingDirection is not None:
+            #If the support point along the old separating direction still doesn't reach the origin, we're still separated
+            P = support(self.polygonA, self.polygonB, separatingDirection)
+            self.numSupportCalls += 1
+            if P.dot(separatingDirection) < 0:
+                return False
+            return None
+
+        #If the simplex rebuilt from the old directions still contains the origin, we're still overlapping
+        (C, B, A) = [support(self.polygonA, self.polygonB, d) for d in simplexDirections]
+        self.numSupportCalls += 3
+        if isPointInTriangle(Vector(0.0, 0.0), A, B, C):
+            self.final_simplex = [C, B, A]
+            return True
+        return None
 
     def calculate(self):
-        """ We pick an arbitrary starting direction and put it in our simplex - so we start with a 0-simplex. We then invert the direction of that point to get a second point, directly opposite to our starting point, creating our initial 1-simplex. We then get the vector triple product to give us a perpendicular vector towards the origin to evolve our 2-simplex. In the main loop of the function, we check if the origin lies in either of the Voronoi regions. If the origin lies in the AB Voronoi region, then we create a perpendicular from AB pointing towards the origin, and set that as the new direction, then use it to replace C. If it lies in the AC Voronoi region, we create a perpendicular from AC pointing towards the origin and use that to replace B. If the origin is in neither Voronoi region, then it must be within the triangle formed by ABC, so we return true and terminate. Otherwise, we start the loop over and continue to evolve the simplex until our iteration limit is reached. """
-        
-        C = support(self.polygonA, self.polygonB, Vector(1.0, 0.0))
-        d = C * -1.0
-        B = support(self.polygonA, self.polygonB, d)
-        if(B.dot(d) < 0):
-            return False
+        """ We pick an arbitrary starting direction and put it in our simplex - so we start with a 0-simplex. We then invert the direction of that point to get a second point, directly opposite to our starting point, creating our initial 1-simplex. We then get the vector triple product to give us a perpendicular vector towards the origin to evolve our 2-simplex. In the main loop of the function, we check if the origin lies in either of the Voronoi regions. If the origin lies in the AB Voronoi region, then we create a perpendicular from AB pointing towards the origin, and set that as the new direction, then drop C and make the new support point A. If it lies in the AC Voronoi region, we create a perpendicular from AC pointing towards the origin, drop B and make the new support point A. If the origin is in neither Voronoi region, then it must be within the triangle formed by ABC, so we return true and terminate. Otherwise, we start the loop over and continue to evolve the simplex. If a new direction comes out as zero the origin is right on the simplex, so the polygons are touching and we return true. If we hit the iteration limit without ever finding a separating direction we also return true, but set hitIterationLimit. Whenever a new support point doesn't make it past the origin along its search direction, that direction separates the shapes and we can return false straight away. If we have a cache, we try the result of the last query on this pair first, and start from its direction if it no longer holds. If we have metrics, the call is timed and its iteration and support call counts are recorded. """
+
+        self.hitIterationLimit = False
+        self.numIterations = 0
+        self.numSupportCalls = 0
+
+        if self.metrics is None:
+            return self.__calculate()
+
+        start = time.perf_counter()
+        result = self.__calculate()
+        self.metrics.record('gjk', time.perf_counter() - start, {'iterations': self.numIterations, 'supportCalls': self.numSupportCalls})
+        if self.hitIterationLimit:
+            self.metrics.flag('gjk', 'iteration_limit', self.polygonA, self.polygonB)
+        return result
+
+    def __calculate(self):
+        startDirection = Vector(1.0, 0.0)
+
+        if self.cache is not None:
+            entry = self.cache.get(self.polygonA, self.polygonB)
+            if entry is not None:
+                result = self.__warmStart(entry)
+                if result is not None:
+                    return result
+                startDirection = entry[0] if entry[0] is not None else entry[1][2]
+
+        dC = startDirection
+        C = support(self.polygonA, self.polygonB, dC)
+        dB = C * -1.0
+        B = support(self.polygonA, self.polygonB, dB)
+        self.numSupportCalls += 2
+        if(B.dot(dB) < 0):
+            return self.__separated(dB)
         
         BC = C - B
         BO = B * -1.0
-        d = getTripleProduct(BC, BO, BC)
+        dA = getTripleProduct(BC, BO, BC)
 
-        A = support(self.polygonA, self.polygonB, d)
-        numIterations = 0
+        #The origin is on the line through B and C, and since B made it past the origin it's between them. There's no
+        #perpendicular towards the origin, so either side of BC will do, unless B and C are both the origin itself
+        if dA.x == 0.0 and dA.y == 0.0:
+            if BC.x == 0.0 and BC.y == 0.0:
+                return self.__touching([C, B])
+            dA = Vector(-BC.y, BC.x)
+
+        A = support(self.polygonA, self.polygonB, dA)
+        self.numSupportCalls += 1
+        if A.dot(dA) < 0:
+            return self.__separated(dA)
 
         while True:
 
-            numIterations += 1
+            self.numIterations += 1
 
-            #Stop this from blowing up, return if iteration limit reached
-            if numIterations > 30:
-                return False
+            #Stop this from blowing up. Every support point so far has made it past the origin, so nothing has shown the
+            #polygons are apart - we call it a collision and leave hitIterationLimit set so it can be looked into
+            if self.numIterations > self.MAX_ITERATIONS:
+                self.hitIterationLimit = True
+                self.final_simplex = [C, B, A]
+                return True
 
             AB = B - A
             AC = C - A
@@ -38,21 +112,123 @@ class GJKAlgorithm:
             AO = A * -1.0
 
             if AbPerp.dot(AO) >= 0:
-                d = AbPerp
-                C = support(self.polygonA, self.polygonB, d)
+                #A landed on the line through the other two, which only happens when the origin is on that line too
+                if AbPerp.x == 0.0 and AbPerp.y == 0.0:
+                    return self.__touching([C, B, A])
+
+                #C is dropped and the new point becomes A, since the next round has to test the edges touching the newest point
+                (C, dC) = (B, dB)
+                (B, dB) = (A, dA)
+                dA = AbPerp
+                A = support(self.polygonA, self.polygonB, dA)
+                self.numSupportCalls += 1
+                if A.dot(dA) < 0:
+                    return self.__separated(dA)
                 continue
 
             AcPerp = getTripleProduct(AB, AC, AC)
             if AcPerp.dot(AO) >= 0:
-                d = AcPerp
-                B = support(self.polygonA, self.polygonB, d)
+                if AcPerp.x == 0.0 and AcPerp.y == 0.0:
+                    return self.__touching([C, B, A])
+
+                #Same thing, but B is dropped
+                (B, dB) = (A, dA)
+                dA = AcPerp
+                A = support(self.polygonA, self.polygonB, dA)
+                self.numSupportCalls += 1
+                if A.dot(dA) < 0:
+                    return self.__separated(dA)
                 continue
 
             self.final_simplex = [C, B, A]
+            if self.cache is not None:
+                self.cache.store(self.polygonA, self.polygonB, simplexDirections=[dC, dB, dA])
             return True
+
+    def __touching(self, simplex):
+        """The origin is right on the simplex, so the polygons are just touching, which counts as a collision. The simplex
+        is flat, so it isn't cached, a warm start could never find the origin inside it"""
+        self.final_simplex = simplex
+        return True
+
+    def __getClosestOnSegment(self, simplex):
+        """Closest point to the origin on the segment between the two simplex points, returns (point, weights, simplex),
+        where the simplex has been cut down to the points that are actually needed to describe it"""
+        (P, Q) = (simplex[0][0], simplex[1][0])
+        PQ = Q - P
+        lengthSquared = PQ.getMagnitudeSquared()
+        t = 0.0 if lengthSquared == 0.0 else -P.dot(PQ) / lengthSquared
+
+        if t <= 0.0:
+            return (P, [1.0], simplex[:1])
+        if t >= 1.0:
+            return (Q, [1.0], simplex[1:])
+        return (P + PQ * t, [1.0 - t, t], simplex)
+
+    def calculateDistance(self):
+        """ Finds how far apart the two polygons are when they don't overlap. Instead of trying to surround the origin, we walk the simplex towards it - at each step we find the point of the simplex closest to the origin, then add the support point in the direction from there to the origin, and drop whatever simplex points aren't needed to describe the closest point. Once a new support point doesn't get us meaningfully closer, we're done. We keep the points of A and B that made each simplex point, so the closest point's weights give us the closest point on each polygon as well. Returns (distance, closest point on A, closest point on B, unit direction from A to B), or (0, None, None, None) if the polygons overlap. """
+
+        d = self.polygonA.origin - self.polygonB.origin
+        if d.getMagnitudeSquared() == 0.0:
+            d = Vector(1.0, 0.0)
+
+        pointA = self.polygonA.getFurthestPoint(d * -1.0)
+        pointB = self.polygonB.getFurthestPoint(d)
+        simplex = [(pointB - pointA, pointA, pointB)]
+        closest = simplex[0][0]
+        weights = [1.0]
+
+        for i in range(self.MAX_ITERATIONS):
+            distanceSquared = closest.getMagnitudeSquared()
+            if distanceSquared == 0.0:
+                return (0.0, None, None, None)
+
+            d = closest * -1.0
+            pointA = self.polygonA.getFurthestPoint(closest)
+            pointB = self.polygonB.getFurthestPoint(d)
+            W = pointB - pointA
+
+            #How much closer the new support point could get us, once that's within tolerance we've converged
+            if distanceSquared - closest.dot(W) <= self.DISTANCE_TOLERANCE * math.sqrt(distanceSquared):
+                break
+
+            simplex.append((W, pointA, pointB))
+
+            if len(simplex) == 2:
+                (closest, weights, simplex) = self.__getClosestOnSegment(simplex)
+                continue
+
+            #With three points, either the origin is inside the triangle or the closest point is on one of its edges
+            (A, B, C) = [point[0] for point in simplex]
+            if isPointInTriangle(Vector(0.0, 0.0), A, B, C):
+                return (0.0, None, None, None)
+
+            best = None
+            for edge in ([simplex[0], simplex[2]], [simplex[1], simplex[2]], [simplex[0], simplex[1]]):
+                result = self.__getClosestOnSegment(edge)
+                if best is None or result[0].getMagnitudeSquared() < best[0].getMagnitudeSquared():
+                    best = result
+            (closest, weights, simplex) = best
+
+        closestA = Vector(0.0, 0.0)
+        closestB = Vector(0.0, 0.0)
+        for (weight, point) in zip(weights, simplex):
+            closestA = closestA + point[1] * weight
+            closestB = closestB + point[2] * weight
+
+        distance = closest.getMagnitude()
+        return (distance, closestA, closestB, closest / distance)
+
+    def __separated(self, direction):
+        if self.cache is not None:
+            self.cache.store(self.polygonA, self.polygonB, separatingDirection=direction)
+        return False
                 
 
 if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
     polyA = Polygon(Vector(215.0, 215.0))
     polyA.addPoint(Vector(0.0, 50.0))
     polyA.addPoint(Vector(-50.0, 0.0))
@@ -73,6 +249,7 @@ if __name__ == '__main__':
 
     clock = pygame.time.Clock()
     
+    cache = GJKCache()
     currentControl = 1
     speed = 6.0
     rot_speed = 0.15
@@ -96,13 +273,18 @@ if __name__ == '__main__':
             polyB.rotation += keys[pygame.K_r] * rot_speed * 0.1666
 
 
-        myGJK = GJKAlgorithm(polyA, polyB)
+        myGJK = GJKAlgorithm(polyA, polyB, cache)
         isColliding = myGJK.calculate()
 
         screen.fill((0, 0, 0))
         drawPolygon(screen, polyA, color = (255, 255, 255) if not isColliding else (255, 0, 0))
         drawPolygon(screen, polyB, color = (255, 255, 255) if not isColliding else (255, 0, 0))
 
+        if not isColliding:
+            (distance, closestA, closestB, direction) = myGJK.calculateDistance()
+            if closestA is not None:
+                drawLine(screen, closestA, closestB)
+
         pygame.display.flip()
         clock.tick(60)
 
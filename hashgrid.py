@@ -0,0 +1,173 @@
+from utils.utilbase import *
+import sat
+import math
+import random
+
+class SpatialHashGrid:
+    """ A uniform grid broad phase. Each polygon is binned into every cell its world space bounding box touches, and only polygons that share a cell are considered as candidate pairs for the narrow phase. The cells are stored sparsely in a dictionary, so the grid has no fixed size. The cell size should be somewhere around the size of a typical polygon - too small and big polygons end up in lots of cells, too big and the cells fill up with polygons that aren't anywhere near each other. """
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {}
+
+        #For each polygon we keep the range of cells it was binned into, so moving it only touches the cells that changed
+        self.__cellRanges = {}
+
+    def __len__(self):
+        return len(self.__cellRanges)
+
+    def __contains__(self, poly):
+        return poly in self.__cellRanges
+
+    def __iter__(self):
+        return iter(self.__cellRanges)
+
+    def __getCellRange(self, aabb):
+        return (math.floor(aabb.minX / self.cellSize), math.floor(aabb.minY / self.cellSize), math.floor(aabb.maxX / self.cellSize), math.floor(aabb.maxY / self.cellSize))
+
+    def __addToCells(self, poly, cellRange):
+        (minX, minY, maxX, maxY) = cellRange
+        for i in range(minX, maxX + 1):
+            for j in range(minY, maxY + 1):
+                self.cells.setdefault((i, j), {})[poly] = None
+
+    def __removeFromCells(self, poly, cellRange):
+        (minX, minY, maxX, maxY) = cellRange
+        for i in range(minX, maxX + 1):
+            for j in range(minY, maxY + 1):
+                cell = self.cells[(i, j)]
+                del cell[poly]
+                if len(cell) == 0:
+                    del self.cells[(i, j)]
+
+    def insert(self, poly):
+        if poly in self.__cellRanges:
+            return self.move(poly)
+
+        cellRange = self.__getCellRange(poly.getAABB())
+        self.__cellRanges[poly] = cellRange
+        self.__addToCells(poly, cellRange)
+        return True
+
+    def remove(self, poly):
+        cellRange = self.__cellRanges.pop(poly)
+        self.__removeFromCells(poly, cellRange)
+
+    def move(self, poly):
+        """Rebins a polygon after its origin or rotation has changed. Returns False if it is still in the same cells, in which case nothing had to be done"""
+        oldRange = self.__cellRanges[poly]
+        newRange = self.__getCellRange(poly.getAABB())
+
+        if newRange == oldRange:
+            return False
+
+        self.__removeFromCells(poly, oldRange)
+        self.__addToCells(poly, newRange)
+        self.__cellRanges[poly] = newRange
+        return True
+
+    def update(self):
+        """Rebins every polygon in the grid, call this once per frame after moving things around"""
+        for poly in self.__cellRanges:
+            self.move(poly)
+
+    def getCandidatePairs(self):
+        """Yields every unique pair of polygons whose bounding boxes overlap. A pair that shares several cells
+        is only reported by the first cell they share, the one at the min corner of the overlap of their cell ranges,
+        so we don't need to keep a set of the pairs we've already seen."""
+        for (cellKey, cell) in self.cells.items():
+            if len(cell) < 2:
+                continue
+
+            polygons = list(cell)
+            for i in range(len(polygons)):
+                polyA = polygons[i]
+                rangeA = self.__cellRanges[polyA]
+                aabbA = polyA.getAABB()
+
+                for j in range(i + 1, len(polygons)):
+                    polyB = polygons[j]
+                    rangeB = self.__cellRanges[polyB]
+
+                    if (max(rangeA[0], rangeB[0]), max(rangeA[1], rangeB[1])) != cellKey:
+                        continue
+
+                    if aabbA.overlaps(polyB.getAABB()):
+                        yield (polyA, polyB)
+
+    def query(self, aabb):
+        """Returns every polygon whose bounding box overlaps the given box"""
+        (minX, minY, maxX, maxY) = self.__getCellRange(aabb)
+        results = {}
+
+        for i in range(minX, maxX + 1):
+            for j in range(minY, maxY + 1):
+                for poly in self.cells.get((i, j), ()):
+                    if poly not in results and poly.getAABB().overlaps(aabb):
+                        results[poly] = None
+
+        return list(results)
+
+if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
+    random.seed(1)
+    grid = SpatialHashGrid(80.0)
+    velocities = {}
+
+    for k in range(60):
+        poly = Polygon(Vector(random.uniform(50, 750), random.uniform(50, 550)), random.uniform(0, 2.0 * math.pi))
+        numPoints = random.randint(3, 8)
+        angle = 2.0 * math.pi / numPoints
+        radius = random.uniform(10, 30)
+        for i in range(0, -numPoints, -1):
+            poly.addPoint(Vector(radius * math.cos(angle * i), radius * math.sin(angle * i)))
+
+        grid.insert(poly)
+        velocities[poly] = Vector(random.uniform(-1, 1), random.uniform(-1, 1))
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Spatial Hash Grid Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        for poly in grid:
+            poly.origin += velocities[poly]
+            poly.rotation += 0.01
+            if poly.origin.x < 0 or poly.origin.x > 800:
+                velocities[poly].x *= -1.0
+            if poly.origin.y < 0 or poly.origin.y > 600:
+                velocities[poly].y *= -1.0
+
+        grid.update()
+
+        colliding = set()
+        numCandidates = 0
+        for (polyA, polyB) in grid.getCandidatePairs():
+            numCandidates += 1
+            if sat.SeparatingAxisTest(polyA, polyB).calculate()[0]:
+                colliding.add(polyA)
+                colliding.add(polyB)
+
+        screen.fill((0, 0, 0))
+        for (i, j) in grid.cells:
+            pygame.draw.rect(screen, (40, 40, 40), (i * grid.cellSize, j * grid.cellSize, grid.cellSize, grid.cellSize), 1)
+        for poly in grid:
+            drawPolygon(screen, poly, color = (255, 0, 0) if poly in colliding else (255, 255, 255))
+
+        candidateText = font.render("Candidate pairs " + str(numCandidates), True, (255, 255, 255))
+        screen.blit(candidateText, (500, 560))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
@@ -0,0 +1,134 @@
+from utils.utilbase import *
+import sat
+import epa
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+def attachSharedMemory(name):
+    try:
+        #Python 3.13 and up, stops the worker's resource tracker from unlinking the block when the worker exits
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def getBufferViews(buffer, numPolygons, maxPoints):
+    """The shared block holds the padded (numPolygons, maxPoints, 2) world space points followed by the point count of each polygon"""
+    pointsSize = numPolygons * maxPoints * 2 * 8
+    points = np.ndarray((numPolygons, maxPoints, 2), dtype=np.float64, buffer=buffer)
+    counts = np.ndarray((numPolygons,), dtype=np.int64, buffer=buffer, offset=pointsSize)
+    return (points, counts)
+
+#The polygons a worker has rebuilt for the current frame's block, so chunks of the same frame can share them
+workerPolygons = {}
+workerBlockName = None
+
+def getWorkerPolygons(name, numPolygons, maxPoints, indices):
+    """Runs in a worker process. Reads the world space points straight out of the shared block and rebuilds just the
+    polygons that are asked for and haven't been rebuilt already this frame. The points are already in world space, so
+    each one is placed at its own centroid with no rotation, which puts them back exactly where they were. Returns the
+    dict of polygon index to polygon."""
+    global workerPolygons, workerBlockName
+
+    if workerBlockName != name:
+        workerPolygons = {}
+        workerBlockName = name
+
+    polygons = workerPolygons
+    missing = set(indices).difference(polygons)
+
+    if len(missing) > 0:
+        block = attachSharedMemory(name)
+        try:
+            (points, counts) = getBufferViews(block.buf, numPolygons, maxPoints)
+            for index in missing:
+                worldPoints = points[index, :counts[index]]
+                (x, y) = worldPoints.mean(axis=0).tolist()
+                polygons[index] = Polygon.fromArray(worldPoints, Vector(x, y))
+
+            #Drop our views into the block before closing it
+            del points, counts, worldPoints
+        finally:
+            block.close()
+
+    return polygons
+
+def calculateChunk(name, numPolygons, maxPoints, algorithm, chunk):
+    """Runs in a worker process, works out the narrow phase for a chunk of (indexA, indexB) pairs"""
+    polygons = getWorkerPolygons(name, numPolygons, maxPoints, chunk.ravel().tolist())
+
+    results = []
+    for (indexA, indexB) in chunk.tolist():
+        if algorithm == 'sat':
+            (isColliding, depth, normal) = sat.SeparatingAxisTest(polygons[indexA], polygons[indexB]).calculate()
+        else:
+            (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(polygons[indexA], polygons[indexB]).calculate()
+        #Send plain floats back, they pickle a lot smaller than Vectors
+        results.append((isColliding, depth, None if normal is None else (normal.x, normal.y)))
+
+    return results
+
+class ParallelNarrowPhase:
+    """ Runs the narrow phase over a process pool. Each call to calculate publishes the world space points of every polygon involved into one shared memory block, the candidate pairs are split into chunks of polygon indices, and each worker reads the points it needs straight out of the shared block instead of having Polygon objects pickled over to it. The workers still need Polygon objects to run SAT or EPA on, so they rebuild them from those points - once per polygon per frame in each worker, which is much cheaper than pickling them but isn't free. What gets saved is the pickling and the copying, not the construction. Use it as a context manager, or call close when done, to shut the pool down. """
+    def __init__(self, algorithm='epa', maxWorkers=None, chunksPerWorker=4):
+        if algorithm not in ('sat', 'epa'):
+            raise ValueError("algorithm must be 'sat' or 'epa', not " + repr(algorithm))
+
+        self.algorithm = algorithm
+        self.maxWorkers = maxWorkers if maxWorkers is not None else os.cpu_count()
+        #A few chunks per worker evens things out when some chunks are slower than others
+        self.chunksPerWorker = chunksPerWorker
+        self.executor = ProcessPoolExecutor(self.maxWorkers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def calculate(self, pairs):
+        """Returns a list with one (isColliding, depth, normal) tuple per pair, in the same order and the same form as
+        SeparatingAxisTest.calculate or ExpandingPolytopeAlgorithm.calculate"""
+        pairs = list(pairs)
+        if len(pairs) == 0:
+            return []
+
+        polygons = []
+        indices = {}
+        pairIndices = np.empty((len(pairs), 2), dtype=np.intp)
+        for (i, (polyA, polyB)) in enumerate(pairs):
+            for (j, poly) in enumerate((polyA, polyB)):
+                if poly not in indices:
+                    indices[poly] = len(polygons)
+                    polygons.append(poly)
+                pairIndices[i, j] = indices[poly]
+
+        (packedPoints, _, packedCounts) = packPolygons(polygons)
+        (numPolygons, maxPoints) = packedPoints.shape[:2]
+
+        block = shared_memory.SharedMemory(create=True, size=packedPoints.nbytes + numPolygons * 8)
+        try:
+            (points, counts) = getBufferViews(block.buf, numPolygons, maxPoints)
+            points[:] = packedPoints
+            counts[:] = packedCounts
+            del points, counts
+
+            #Sorting the pairs keeps the polygons each chunk needs close together, so workers rebuild fewer of them
+            order = np.argsort(pairIndices[:, 0], kind='stable')
+            numChunks = min(len(pairs), self.maxWorkers * self.chunksPerWorker)
+            chunks = np.array_split(order, numChunks)
+            futures = [self.executor.submit(calculateChunk, block.name, numPolygons, maxPoints, self.algorithm, pairIndices[chunk]) for chunk in chunks]
+
+            results = [None] * len(pairs)
+            for (chunk, future) in zip(chunks, futures):
+                for (pairIndex, (isColliding, depth, normal)) in zip(chunk.tolist(), future.result()):
+                    results[pairIndex] = (isColliding, depth, None if normal is None else Vector(normal[0], normal[1]))
+        finally:
+            block.close()
+            block.unlink()
+
+        return results
@@ -0,0 +1,188 @@
+from utils.utilbase import *
+import sat
+import epa
+import sha
+import itertools
+import time
+import math
+import random
+
+class CollisionPipeline:
+    """ Runs candidate pairs from a broad phase through the rest of collision detection lazily. The pairs are pulled from the input a chunk at a time, and each chunk goes through the bounds test, then the narrow phase (SAT, batched over the chunk, or GJK followed by EPA), then clipping for the contact points, before the next chunk is even read. So whoever is consuming the results can start on the first chunk straight away, and no matter how many pairs there are, only one chunk is ever held in memory. Each stage can be switched off - skip the bounds test if the broad phase already did it, or skip clipping if you only need the normal and depth. Clipping is always batched over the chunk, and if there is a manifold cache the manifolds are rebuilt from the batched results and carried through it the same as the per pair clipper would. With metrics, EPA records every call as usual while the batched stages record one 'sat_batch' or 'sha_batch' sample per chunk with its pair count and how many collided or how many contacts came out. The batched SAT keeps nothing between frames, so a gjkCache with the 'sat' narrow phase is a ValueError rather than being ignored. """
+    def __init__(self, narrowPhase='sat', chunkSize=256, boundsTest=True, clip=True, gjkCache=None, manifoldCache=None, metrics=None):
+        self.narrowPhase = narrowPhase
+        self.chunkSize = chunkSize
+        self.boundsTest = boundsTest
+        self.clip = clip
+        self.gjkCache = gjkCache
+        self.manifoldCache = manifoldCache
+        self.metrics = metrics
+        self.__checkOptions()
+
+    def __getChunks(self, pairs):
+        pairs = iter(pairs)
+        while True:
+            chunk = list(itertools.islice(pairs, self.chunkSize))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    def __testBounds(self, chunks):
+        for chunk in chunks:
+            yield [(polyA, polyB) for (polyA, polyB) in chunk if polyA.getAABB().overlaps(polyB.getAABB())]
+
+    def __getPolygonIndices(self, pairs):
+        """Returns the distinct polygons in the pairs and each pair as indices into them, for the batched stages"""
+        polygons = []
+        indices = {}
+        pairIndices = []
+        for pair in pairs:
+            for poly in pair:
+                if poly not in indices:
+                    indices[poly] = len(polygons)
+                    polygons.append(poly)
+            pairIndices.append((indices[pair[0]], indices[pair[1]]))
+
+        return (polygons, pairIndices)
+
+    def __checkOptions(self):
+        if self.narrowPhase not in ('sat', 'epa'):
+            raise ValueError("narrowPhase must be 'sat' or 'epa', not " + repr(self.narrowPhase))
+        if self.narrowPhase == 'sat' and self.gjkCache is not None:
+            raise ValueError("gjkCache is only used by the 'epa' narrow phase, the batched SAT has nothing to cache")
+
+    def __runNarrowPhase(self, chunks):
+        """Turns each chunk of pairs into a chunk of (pair, depth, normal) for the pairs that collide"""
+        for chunk in chunks:
+            if len(chunk) == 0:
+                yield []
+                continue
+
+            if self.narrowPhase == 'sat':
+                start = time.perf_counter()
+                (polygons, pairIndices) = self.__getPolygonIndices(chunk)
+                (isColliding, depths, normals) = sat.BatchSeparatingAxisTest(polygons, pairIndices).calculate()
+                colliding = np.flatnonzero(isColliding).tolist()
+                if self.metrics is not None:
+                    self.metrics.record('sat_batch', time.perf_counter() - start, {'pairs': len(chunk), 'colliding': len(colliding)})
+                yield [(chunk[i], depths[i].item(), Vector(*normals[i].tolist())) for i in colliding]
+            else:
+                results = []
+                for (polyA, polyB) in chunk:
+                    (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(polyA, polyB, self.gjkCache, self.metrics).calculate()
+                    if isColliding:
+                        results.append(((polyA, polyB), depth, normal))
+                yield results
+
+    def __clipContacts(self, chunks):
+        for chunk in chunks:
+            if not self.clip or len(chunk) == 0:
+                yield [(pair, depth, normal, None) for (pair, depth, normal) in chunk]
+                continue
+
+            start = time.perf_counter()
+            (polygons, pairIndices) = self.__getPolygonIndices([pair for (pair, depth, normal) in chunk])
+            normals = [normal.asList2() for (pair, depth, normal) in chunk]
+            depths = [depth for (pair, depth, normal) in chunk]
+            (points, featureIds, separations, offsets, referenceFromA) = sha.BatchSutherlandHodgemanAlgorithm(polygons, pairIndices, normals, depths).calculate()
+
+            points = toVectorList(points)
+            offsets = offsets.tolist()
+            if self.manifoldCache is not None:
+                self.__updateManifolds(chunk, points, featureIds.tolist(), separations.tolist(), offsets, referenceFromA.tolist())
+            if self.metrics is not None:
+                self.metrics.record('sha_batch', time.perf_counter() - start, {'pairs': len(chunk), 'contacts': len(points)})
+
+            yield [(pair, depth, normal, points[offsets[i]:offsets[i + 1]]) for (i, (pair, depth, normal)) in enumerate(chunk)]
+
+    def __updateManifolds(self, chunk, points, featureIds, separations, offsets, referenceFromA):
+        """Builds the same manifolds SutherlandHodgemanAlgorithm would from the batched results and runs them through the cache"""
+        for (i, (pair, depth, normal)) in enumerate(chunk):
+            contacts = [sha.ContactPoint(points[k], tuple(featureIds[k]), separations[k]) for k in range(offsets[i], offsets[i + 1])]
+            self.manifoldCache.update(pair[0], pair[1], sha.ContactManifold(normal, 'A' if referenceFromA[i] else 'B', contacts))
+
+    def processChunks(self, pairs):
+        """Yields a list of (pair, depth, normal, contactPoints) records for each chunk of pairs, with only the colliding
+        pairs in it. contactPoints is None if clipping is off. A chunk can come out empty if nothing in it collided"""
+        self.__checkOptions()
+        chunks = self.__getChunks(pairs)
+        if self.boundsTest:
+            chunks = self.__testBounds(chunks)
+        return self.__clipContacts(self.__runNarrowPhase(chunks))
+
+    def process(self, pairs):
+        """Yields a (pair, depth, normal, contactPoints) record for each colliding pair, one chunk at a time"""
+        for chunk in self.processChunks(pairs):
+            yield from chunk
+
+if __name__ == '__main__':
+    import pygame
+    import hashgrid
+    from utils.rendering import *
+
+    random.seed(1)
+    grid = hashgrid.SpatialHashGrid(80.0)
+    velocities = {}
+
+    for k in range(60):
+        poly = Polygon(Vector(random.uniform(50, 750), random.uniform(50, 550)), random.uniform(0, 2.0 * math.pi))
+        numPoints = random.randint(3, 8)
+        angle = 2.0 * math.pi / numPoints
+        radius = random.uniform(15, 35)
+        for i in range(0, -numPoints, -1):
+            poly.addPoint(Vector(radius * math.cos(angle * i), radius * math.sin(angle * i)))
+
+        grid.insert(poly)
+        velocities[poly] = Vector(random.uniform(-1, 1), random.uniform(-1, 1))
+
+    collisionPipeline = CollisionPipeline('sat', chunkSize=16, boundsTest=False)
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Collision Pipeline Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_s:
+                    collisionPipeline.narrowPhase = 'sat'
+                elif event.key == pygame.K_e:
+                    collisionPipeline.narrowPhase = 'epa'
+
+        for poly in grid:
+            poly.origin += velocities[poly]
+            poly.rotation += 0.01
+            if poly.origin.x < 0 or poly.origin.x > 800:
+                velocities[poly].x *= -1.0
+            if poly.origin.y < 0 or poly.origin.y > 600:
+                velocities[poly].y *= -1.0
+
+        grid.update()
+
+        screen.fill((0, 0, 0))
+        for poly in grid:
+            drawPolygon(screen, poly)
+
+        #The grid already checks the bounding boxes, so the pipeline goes straight to the narrow phase
+        numContacts = 0
+        for ((polyA, polyB), depth, normal, contactPoints) in collisionPipeline.process(grid.getCandidatePairs()):
+            drawPolygon(screen, polyA, color = (255, 0, 0))
+            drawPolygon(screen, polyB, color = (255, 0, 0))
+            for point in contactPoints:
+                drawCircle(screen, point, 3.0, color=(0, 0, 255))
+            numContacts += 1
+
+        contactText = font.render("Colliding pairs " + str(numContacts) + (" (SAT)" if collisionPipeline.narrowPhase == 'sat' else " (EPA)"), True, (255, 255, 255))
+        screen.blit(contactText, (500, 560))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
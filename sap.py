@@ -0,0 +1,201 @@
+from utils.utilbase import *
+import gjk
+import math
+import random
+
+class Endpoint:
+    def __init__(self, poly, value, isMin):
+        self.poly = poly
+        self.value = value
+        self.isMin = isMin
+
+class SweepAndPrune:
+    """ An incremental sort and sweep broad phase. We keep a sorted list of bounding box endpoints for each axis, and every update we patch the lists up with an insertion sort. Since bodies only move a little between frames, each endpoint only moves a few places and the sort is close to linear. Whenever a min endpoint passes a max endpoint (or vice versa), the intervals of the two bodies on that axis have started (or stopped) overlapping, and a pair is active when its intervals overlap on both axes. Instead of a full pair list, update returns the pairs that were added and removed since the last update. """
+    def __init__(self):
+        self.xEndpoints = []
+        self.yEndpoints = []
+
+        #Each polygon maps to its four endpoints, and the order it was inserted in, which we use to order the pairs
+        self.__endpoints = {}
+        self.__handles = {}
+        self.__nextHandle = 0
+
+        #Number of axes each pair overlaps on, a pair is only active when this reaches 2
+        self.__overlapCounts = {}
+        self.__activePairs = {}
+
+        #Pairs whose state changed since the last update, mapped to whether they were active before
+        self.__changedPairs = {}
+
+    def __len__(self):
+        return len(self.__endpoints)
+
+    def __contains__(self, poly):
+        return poly in self.__endpoints
+
+    def __iter__(self):
+        return iter(self.__endpoints)
+
+    def __getPairKey(self, polyA, polyB):
+        if self.__handles[polyA] < self.__handles[polyB]:
+            return (polyA, polyB)
+        return (polyB, polyA)
+
+    def __changeOverlap(self, polyA, polyB, delta):
+        key = self.__getPairKey(polyA, polyB)
+        count = self.__overlapCounts.get(key, 0) + delta
+
+        if key not in self.__changedPairs:
+            self.__changedPairs[key] = key in self.__activePairs
+
+        if count == 0:
+            del self.__overlapCounts[key]
+        else:
+            self.__overlapCounts[key] = count
+
+        if count == 2:
+            self.__activePairs[key] = None
+        else:
+            self.__activePairs.pop(key, None)
+
+    def __sortAxis(self, endpoints):
+        for i in range(1, len(endpoints)):
+            current = endpoints[i]
+            j = i - 1
+
+            while j >= 0 and endpoints[j].value > current.value:
+                other = endpoints[j]
+
+                #A min moving left past a max means the two intervals now overlap on this axis
+                #and a max moving left past a min means they no longer do. Min past min or max past max changes nothing
+                if current.isMin and not other.isMin:
+                    self.__changeOverlap(current.poly, other.poly, 1)
+                elif not current.isMin and other.isMin:
+                    self.__changeOverlap(current.poly, other.poly, -1)
+
+                endpoints[j + 1] = other
+                j -= 1
+
+            endpoints[j + 1] = current
+
+    def insert(self, poly):
+        """Adds a polygon, its pairs are reported by the next update. The endpoints are appended past the end of the lists,
+        so the polygon starts out not overlapping anything and the sort moves it into place"""
+        aabb = poly.getAABB()
+        endpoints = (Endpoint(poly, aabb.minX, True), Endpoint(poly, aabb.maxX, False), Endpoint(poly, aabb.minY, True), Endpoint(poly, aabb.maxY, False))
+
+        self.__endpoints[poly] = endpoints
+        self.__handles[poly] = self.__nextHandle
+        self.__nextHandle += 1
+
+        self.xEndpoints.append(endpoints[0])
+        self.xEndpoints.append(endpoints[1])
+        self.yEndpoints.append(endpoints[2])
+        self.yEndpoints.append(endpoints[3])
+
+    def remove(self, poly):
+        """Removes a polygon, any active pairs it was part of are reported as removed by the next update"""
+        endpoints = self.__endpoints.pop(poly)
+        self.xEndpoints = [endpoint for endpoint in self.xEndpoints if endpoint.poly is not poly]
+        self.yEndpoints = [endpoint for endpoint in self.yEndpoints if endpoint.poly is not poly]
+
+        for key in [key for key in self.__overlapCounts if key[0] is poly or key[1] is poly]:
+            if key not in self.__changedPairs:
+                self.__changedPairs[key] = key in self.__activePairs
+            del self.__overlapCounts[key]
+            self.__activePairs.pop(key, None)
+
+        del self.__handles[poly]
+
+    def update(self):
+        """Refreshes the endpoints of every polygon from its bounding box and re-sorts the axes.
+        Returns (added, removed), the lists of pairs that started and stopped overlapping since the last update"""
+        for (poly, endpoints) in self.__endpoints.items():
+            aabb = poly.getAABB()
+            endpoints[0].value = aabb.minX
+            endpoints[1].value = aabb.maxX
+            endpoints[2].value = aabb.minY
+            endpoints[3].value = aabb.maxY
+
+        self.__sortAxis(self.xEndpoints)
+        self.__sortAxis(self.yEndpoints)
+
+        #A pair can flip back and forth during the sort, so we only report the ones whose state actually changed
+        added = []
+        removed = []
+        for (key, wasActive) in self.__changedPairs.items():
+            isActive = key in self.__activePairs
+            if isActive and not wasActive:
+                added.append(key)
+            elif wasActive and not isActive:
+                removed.append(key)
+
+        self.__changedPairs = {}
+        return (added, removed)
+
+    def getCandidatePairs(self):
+        """Yields every pair that was overlapping as of the last update"""
+        return iter(list(self.__activePairs))
+
+if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
+    random.seed(1)
+    broadPhase = SweepAndPrune()
+    velocities = {}
+
+    for k in range(60):
+        poly = Polygon(Vector(random.uniform(50, 750), random.uniform(50, 550)), random.uniform(0, 2.0 * math.pi))
+        numPoints = random.randint(3, 8)
+        angle = 2.0 * math.pi / numPoints
+        radius = random.uniform(10, 30)
+        for i in range(0, -numPoints, -1):
+            poly.addPoint(Vector(radius * math.cos(angle * i), radius * math.sin(angle * i)))
+
+        broadPhase.insert(poly)
+        velocities[poly] = Vector(random.uniform(-1, 1), random.uniform(-1, 1))
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Sweep And Prune Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        for poly in broadPhase:
+            poly.origin += velocities[poly]
+            poly.rotation += 0.01
+            if poly.origin.x < 0 or poly.origin.x > 800:
+                velocities[poly].x *= -1.0
+            if poly.origin.y < 0 or poly.origin.y > 600:
+                velocities[poly].y *= -1.0
+
+        (added, removed) = broadPhase.update()
+
+        colliding = set()
+        numCandidates = 0
+        for (polyA, polyB) in broadPhase.getCandidatePairs():
+            numCandidates += 1
+            if gjk.GJKAlgorithm(polyA, polyB).calculate():
+                colliding.add(polyA)
+                colliding.add(polyB)
+
+        screen.fill((0, 0, 0))
+        for poly in broadPhase:
+            drawPolygon(screen, poly, color = (255, 0, 0) if poly in colliding else (255, 255, 255))
+
+        candidateText = font.render("Candidate pairs " + str(numCandidates) + " (+" + str(len(added)) + " -" + str(len(removed)) + ")", True, (255, 255, 255))
+        screen.blit(candidateText, (450, 560))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
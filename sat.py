@@ -1,80 +1,168 @@
 from utils.utilbase import *
+import numpy as np
+import time
+
+class SeparatingAxisCache(PairCache):
+    """ Remembers, for each pair, the index of the axis that separated it last time, or the axis of least overlap if it was colliding. The next test on that pair tries that axis on its own first, and since things don't move much between frames it usually still separates them, so most rejections only take a single projection. """
 
 class SeparatingAxisTest:
-    def __init__(self, polyA, polyB):
+    def __init__(self, polyA, polyB, cache=None, metrics=None):
         self.polygonA = polyA
         self.polygonB = polyB
+        self.cache = cache
+        self.metrics = metrics
+        self.numAxesTested = 0
         
-        self.polyAPoints = polyA.getTransformedPoints()[0]
-        self.polyBPoints = polyB.getTransformedPoints()[0]
+        self.polyAPoints = polyA.getTransformedArray()
+        self.polyBPoints = polyB.getTransformedArray()
 
-        #Generate a big list made up of all the potential separating axes of both polygons
-        self.axes = [edge.getNormal(self.polyAPoints, True) for edge in polyA.getEdgeList().edges] + [edge.getNormal(self.polyBPoints, True) for edge in polyB.getEdgeList().edges]
+        #Generate a big (n, 2) array made up of all the potential separating axes of both polygons
+        #These are cached on the polygons, and parallel edges only contribute one axis between them
+        self.axes = np.concatenate((polyA.getSeparatingAxes(), polyB.getSeparatingAxes()))
 
-    def calculate(self):
+    def __isSeparatedOn(self, axis):
+        projectionsA = self.polyAPoints @ axis
+        projectionsB = self.polyBPoints @ axis
+        return min(projectionsA.max(), projectionsB.max()) < max(projectionsA.min(), projectionsB.min())
 
-        leastOverlap = float('inf')
-        leastOverlapAxis = self.axes[0]
+    def calculate(self):
+        if self.metrics is None:
+            return self.__calculate()
+
+        start = time.perf_counter()
+        result = self.__calculate()
+        self.metrics.record('sat', time.perf_counter() - start, {'axesTested': self.numAxesTested})
+        return result
+
+    def __calculate(self):
+        #The cached axis is tested on its own, then every axis is projected at once
+        self.numAxesTested = 0
+
+        if self.cache is not None:
+            cachedIndex = self.cache.get(self.polygonA, self.polygonB)
+            if cachedIndex is not None and cachedIndex < len(self.axes):
+                self.numAxesTested = 1
+                if self.__isSeparatedOn(self.axes[cachedIndex]):
+                    return (False, 0, None)
+
+        self.numAxesTested += len(self.axes)
+
+        #Project every point onto every axis in one go, each column holds the projections for one axis
+        #and from that we get the Amin, Amax, Bmin and Bmax for each polygon on that axis
+        projectionsA = self.polyAPoints @ self.axes.T
+        projectionsB = self.polyBPoints @ self.axes.T
+
+        #Check for overlap - we create an interval for every axis. If any interval is negative there is no overlap
+        #on that axis, so we have found a separating axis and there can't be any collision
+        intervalMax = np.minimum(projectionsA.max(axis=0), projectionsB.max(axis=0))
+        intervalMin = np.maximum(projectionsA.min(axis=0), projectionsB.min(axis=0))
+        distances = intervalMax - intervalMin
+
+        if (distances < 0).any():
+            #The axis with the biggest gap is the one most likely to still separate them next time
+            if self.cache is not None:
+                self.cache.store(self.polygonA, self.polygonB, int(np.argmin(distances)))
+            return (False, 0, None)
 
         #We want our collision normals to point FROM B to A
         #In other words, vector BA, which is generated by the origin of point A - origin of point B
-        #We will use this in a bit
-        relativeVector = self.polygonA.origin - self.polygonB.origin
-
-        for axis in self.axes:
-
-            a_min, b_min = float('inf'), float('inf')
-            a_max, b_max = float('-inf'), float('-inf')
-
-            #Iterate through each axis, finding the Amin, Amax, Bmin and Bmax for each polygon on that axis
-
-            for point in self.polyAPoints:
-                projection = point.dot(axis)
-
-                #Note that this is an if statement and not an elif
-                #This caused a very subtle bug where my infinities were not being replaced
-                #It is entirely possible that in an early iteration through the points, the minimum and maximum points
-                #may be the exact same value - this corrects itself in subsequent iterations
-                if projection < a_min:
-                    a_min = projection
-                if projection > a_max:
-                    a_max = projection
-
-            for point in self.polyBPoints:
-                projection = point.dot(axis)
-
-                if projection < b_min:
-                    b_min = projection
-                if projection > b_max:
-                    b_max = projection
-
-            #Check for overlap - we create an interval. If the interval is positive, we save it and its associated axis as our 
-            # newest least overlap values If there is no overlap, we can exit early, since we have found a separating axis, so there
-            # can't be any collision
-
-            intervalMax = min(a_max, b_max)
-            intervalMin = max(a_min, b_min)
-            dist = intervalMax - intervalMin
-            if dist < 0:
-                #There is no overlap, so we have found a separating axis and can terminate early
-                return (False, 0, None)
-            
-            if dist <= leastOverlap:
-                #We found a new overlap interval less than or equal to our current one
-                #We want to ensure that our direction vector points from B to A
-                #By using the dot product, we compare the new and old overlap vector to our desired target direction BA
-                #If the new vector is more in the direction of BA than the old one, then we replace the old vector
-                #This is to keep our normals consistent
-                newDot = relativeVector.dot(axis)
-                oldDot = relativeVector.dot(leastOverlapAxis)
-
-                if newDot > oldDot:
-                    leastOverlap = dist
-                    leastOverlapAxis = axis
-
-        return (True, leastOverlap, leastOverlapAxis)
+        #Since each axis only appears once, we flip it if it points the wrong way. Then we take the axis with
+        #the least overlap, and if there's a tie, the one that is more in the direction of BA
+        originA = self.polygonA.origin
+        originB = self.polygonB.origin
+        relativeDots = self.axes @ (originA.x - originB.x, originA.y - originB.y)
+
+        leastOverlap = distances.min()
+        candidates = np.flatnonzero(distances == leastOverlap)
+        leastOverlapIndex = int(candidates[np.argmax(np.abs(relativeDots[candidates]))])
+
+        if self.cache is not None:
+            self.cache.store(self.polygonA, self.polygonB, leastOverlapIndex)
+
+        (x, y) = self.axes[leastOverlapIndex].tolist()
+        if relativeDots[leastOverlapIndex] < 0:
+            (x, y) = (-x, -y)
+
+        return (True, leastOverlap.item(), Vector(x, y))
+
+class BatchSeparatingAxisTest:
+    """Runs the separating axis test on many pairs at once. Polygons is a list of polygons and pairs is a (k, 2) array
+    of indices into it, typically the candidate pairs from a broad phase. The result of each pair matches
+    SeparatingAxisTest(polygons[a], polygons[b]).calculate(), but they are returned as arrays instead of tuples."""
+    def __init__(self, polygons, pairs, chunkSize=2048):
+        self.polygons = polygons
+        self.pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+        #The projections take k * maxPoints * 2 * maxPoints floats, so we work through the pairs in chunks to cap memory
+        self.chunkSize = chunkSize
+        (self.points, self.normals, self.counts) = packPolygons(polygons)
+        self.origins = np.array([poly.origin.asList2() for poly in polygons], dtype=np.float64).reshape(-1, 2)
+
+    def __calculateChunk(self, indicesA, indicesB):
+        #Every polygon in the chunk fits in the first maxCount rows, the rest is padding we can skip
+        maxCount = max(int(self.counts[indicesA].max()), int(self.counts[indicesB].max()))
+        pointsA = self.points[indicesA, :maxCount]
+        pointsB = self.points[indicesB, :maxCount]
+
+        #Every edge normal of both polygons, parallel ones are left in since they just give the same interval twice
+        axes = np.concatenate((self.normals[indicesA, :maxCount], self.normals[indicesB, :maxCount]), axis=1)
+
+        axesT = axes.transpose(0, 2, 1)
+        projectionsA = pointsA @ axesT
+        projectionsB = pointsB @ axesT
+
+        intervalMax = np.minimum(projectionsA.max(axis=1), projectionsB.max(axis=1))
+        intervalMin = np.maximum(projectionsA.min(axis=1), projectionsB.min(axis=1))
+        distances = intervalMax - intervalMin
+
+        isColliding = (distances >= 0).all(axis=1)
+        depths = np.zeros(len(indicesA))
+        normals = np.zeros((len(indicesA), 2))
+
+        #Only the colliding pairs need a normal, so we drop the rest before picking one
+        colliding = np.flatnonzero(isColliding)
+        if len(colliding) == 0:
+            return (isColliding, depths, normals)
+
+        axes = axes[colliding]
+        distances = distances[colliding]
+
+        #Same rule as the single pair test, each axis is flipped to point from B to A, then we take the least overlap
+        #and break ties with whichever axis is more in the direction of BA
+        relativeVectors = self.origins[indicesA[colliding]] - self.origins[indicesB[colliding]]
+        relativeDots = (axes @ relativeVectors[:, :, None])[:, :, 0]
+
+        rows = np.arange(len(colliding))
+        leastOverlap = distances.min(axis=1)
+        tieBreak = np.where(distances == leastOverlap[:, None], np.abs(relativeDots), -np.inf)
+        leastOverlapIndex = np.argmax(tieBreak, axis=1)
+        flip = np.where(relativeDots[rows, leastOverlapIndex] < 0, -1.0, 1.0)
+
+        depths[colliding] = leastOverlap
+        normals[colliding] = axes[rows, leastOverlapIndex] * flip[:, None]
+
+        return (isColliding, depths, normals)
+
+    def calculate(self):
+        """Returns (isColliding, depths, normals) as (k,), (k,) and (k, 2) arrays, pairs that don't collide get a zero normal"""
+        numPairs = len(self.pairs)
+        isColliding = np.zeros(numPairs, dtype=bool)
+        depths = np.zeros(numPairs)
+        normals = np.zeros((numPairs, 2))
+
+        #Sorting the pairs by size means small polygons aren't padded out to the size of the biggest one in the batch
+        pairSizes = np.maximum(self.counts[self.pairs[:, 0]], self.counts[self.pairs[:, 1]])
+        order = np.argsort(pairSizes, kind='stable')
+
+        for start in range(0, numPairs, self.chunkSize):
+            chunk = order[start:start + self.chunkSize]
+            (isColliding[chunk], depths[chunk], normals[chunk]) = self.__calculateChunk(self.pairs[chunk, 0], self.pairs[chunk, 1])
+
+        return (isColliding, depths, normals)
 
 if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
     polyA = Polygon(Vector(165.0, 175.0))
     polyA.addPoint(Vector(0.0, -60.0))
     polyA.addPoint(Vector(-60.0, 60.0))
@@ -94,6 +182,7 @@ if __name__ == '__main__':
 
     clock = pygame.time.Clock()
 
+    cache = SeparatingAxisCache()
     currentControl = 1
     speed = 6.0
     rot_speed = 0.15
@@ -117,7 +206,7 @@ if __name__ == '__main__':
             polyB.origin += Vector(keys[pygame.K_RIGHT] - keys[pygame.K_LEFT], keys[pygame.K_DOWN] - keys[pygame.K_UP]) * speed * 0.1666
             polyB.rotation += keys[pygame.K_r] * rot_speed * 0.1666
 
-        sat = SeparatingAxisTest(polyA, polyB)
+        sat = SeparatingAxisTest(polyA, polyB, cache)
         (isColliding, penetrationDepth, normal_vector) = sat.calculate()
 
         screen.fill((0, 0, 0))
@@ -0,0 +1,103 @@
+from utils.utilbase import *
+import numpy as np
+
+#Everything is little endian and every section starts on an 8 byte boundary, so each one can be viewed straight out of the map
+SCENE_MAGIC = b'PCSN'
+SCENE_VERSION = 1
+
+#magic, version, number of shapes, number of bodies, number of vertices, then padding up to 32 bytes
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'), ('numShapes', '<u4'), ('numBodies', '<u4'), ('numVertices', '<u8'), ('reserved', '<u8')])
+BODY_DTYPE = np.dtype([('shape', '<i8'), ('x', '<f8'), ('y', '<f8'), ('rotation', '<f8')])
+
+def getSceneLayout(numShapes, numBodies, numVertices):
+    """Returns the byte offsets of the shape offsets, the vertex block and the bodies, and the total size of the file.
+    The file is the header, then numShapes + 1 int64 vertex offsets (shape i owns vertices offsets[i] to offsets[i + 1]),
+    then the flat (numVertices, 2) float64 vertex block, then one (shape index, x, y, rotation) record per body"""
+    offsetsStart = HEADER_DTYPE.itemsize
+    verticesStart = offsetsStart + (numShapes + 1) * 8
+    bodiesStart = verticesStart + numVertices * 2 * 8
+    size = bodiesStart + numBodies * BODY_DTYPE.itemsize
+    return (offsetsStart, verticesStart, bodiesStart, size)
+
+def writeScene(path, polygons):
+    """Writes the polygons to a scene file. Polygons that share a ConvexShape share it in the file too, so each
+    distinct shape's vertices are only stored once"""
+    shapes = []
+    shapeIndices = {}
+    bodies = np.empty(len(polygons), dtype=BODY_DTYPE)
+
+    for (i, poly) in enumerate(polygons):
+        shape = poly.shape
+        if id(shape) not in shapeIndices:
+            shapeIndices[id(shape)] = len(shapes)
+            shapes.append(shape)
+        bodies[i] = (shapeIndices[id(shape)], poly.origin.x, poly.origin.y, poly.rotation)
+
+    offsets = np.zeros(len(shapes) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(shape) for shape in shapes])
+    numVertices = int(offsets[-1])
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (SCENE_MAGIC, SCENE_VERSION, len(shapes), len(polygons), numVertices, 0)
+
+    (offsetsStart, verticesStart, bodiesStart, size) = getSceneLayout(len(shapes), len(polygons), numVertices)
+
+    #Written straight into a map of the output file, so the whole scene never has to be built up in memory first
+    block = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+    try:
+        block[:offsetsStart] = header.view(np.uint8)
+        block[offsetsStart:verticesStart] = offsets.view(np.uint8)
+        vertices = block[verticesStart:bodiesStart].view('<f8').reshape(-1, 2)
+        for (shape, start) in zip(shapes, offsets.tolist()):
+            vertices[start:start + len(shape)] = shape.points
+        block[bodiesStart:] = bodies.view(np.uint8)
+        block.flush()
+    finally:
+        del block
+
+def readSceneArrays(path):
+    """Maps a scene file read only and returns (offsets, vertices, bodies), which are views straight into the map. Raises
+    ValueError if the file isn't a scene, or if its size, shape offsets or shape indices don't agree with its header"""
+    block = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(block) < HEADER_DTYPE.itemsize:
+        raise ValueError(str(path) + " is too short to be a scene file")
+
+    header = block[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    if header['magic'] != SCENE_MAGIC:
+        raise ValueError(str(path) + " is not a scene file")
+    if header['version'] != SCENE_VERSION:
+        raise ValueError(str(path) + " is scene version " + str(header['version']) + ", only version " + str(SCENE_VERSION) + " is supported")
+
+    #The counts say exactly how big the file should be, so anything else means the header or the file is damaged
+    (numShapes, numBodies, numVertices) = (int(header['numShapes']), int(header['numBodies']), int(header['numVertices']))
+    (offsetsStart, verticesStart, bodiesStart, size) = getSceneLayout(numShapes, numBodies, numVertices)
+    if len(block) < size:
+        raise ValueError(str(path) + " is truncated, expected " + str(size) + " bytes but it has " + str(len(block)))
+    if len(block) > size:
+        raise ValueError(str(path) + " has " + str(len(block) - size) + " bytes more than its header says it should")
+
+    offsets = block[offsetsStart:verticesStart].view('<i8')
+    vertices = block[verticesStart:bodiesStart].view('<f8').reshape(-1, 2)
+    bodies = block[bodiesStart:size].view(BODY_DTYPE)
+
+    #Checked up front, otherwise a bad offset or shape index only shows up as a wrong slice or an IndexError while loading
+    if offsets[0] != 0 or offsets[-1] != numVertices or (np.diff(offsets) < 0).any():
+        raise ValueError(str(path) + " has shape offsets that don't run in order from 0 to " + str(numVertices))
+    if numBodies > 0 and (bodies['shape'].min() < 0 or bodies['shape'].max() >= numShapes):
+        raise ValueError(str(path) + " has bodies that use shapes outside 0 to " + str(numShapes - 1))
+
+    return (offsets, vertices, bodies)
+
+def loadScene(path):
+    """Loads every body in a scene file as a Polygon. The shapes are all built at once from the mapped vertex block, and
+    the bodies that use the same shape share it, so there are no per vertex Python calls. The shapes' points stay in the
+    map rather than being copied out of it"""
+    (offsets, vertices, bodies) = readSceneArrays(path)
+
+    shapes = buildConvexShapes(vertices, offsets)
+
+    polygons = []
+    for (shapeIndex, x, y, rotation) in zip(bodies['shape'].tolist(), bodies['x'].tolist(), bodies['y'].tolist(), bodies['rotation'].tolist()):
+        polygons.append(Polygon.fromShape(shapes[shapeIndex], Vector(x, y), rotation))
+
+    return polygons
@@ -1,18 +1,62 @@
 import epa
 import sat
+import time
+import numpy as np
 from utils.utilbase import *
 
+class ContactPoint:
+    """A clipped contact point, the feature id says which edges and clip plane made it so it can be matched up next frame"""
+    def __init__(self, position, featureId, separation):
+        self.position = position
+        self.featureId = featureId
+        self.separation = separation
+        self.normalImpulse = 0.0
+        self.tangentImpulse = 0.0
+        self.isPersistent = False
+
+class ContactManifold:
+    def __init__(self, normal, referenceFrom, points):
+        self.normal = normal
+        self.referenceFrom = referenceFrom
+        self.points = points
+
+class ManifoldCache(PairCache):
+    """ Keeps the contact manifold of each pair from the last frame, so a solver can warm start from the impulses it worked out then. New contact points are matched to old ones by their feature ids, and the ones that match carry the old accumulated impulses forward. Old points that don't match anything are stale and get dropped. The ids are relative to whichever polygon the reference edge was on, so if that flips over nothing is carried. """
+    def update(self, polyA, polyB, manifold):
+        """Stores the new manifold for the pair, after copying the impulses over from the old one, and returns it"""
+        old = self.get(polyA, polyB)
+
+        if old is not None and old.referenceFrom == manifold.referenceFrom:
+            oldPoints = {point.featureId: point for point in old.points}
+            for point in manifold.points:
+                match = oldPoints.get(point.featureId)
+                if match is not None:
+                    point.normalImpulse = match.normalImpulse
+                    point.tangentImpulse = match.tangentImpulse
+                    point.isPersistent = True
+
+        self.store(polyA, polyB, manifold)
+        return manifold
+
 class SutherlandHodgemanAlgorithm:
-    def __init__(self, polyA, polyB, normal, penetrationDepth):
+    """ Finds the contact points of two colliding polygons by clipping one against the other. Every point also gets a feature id, (reference edge index, incident feature, clip plane), where the clip planes are 0 and 1 for the two edges next to the reference edge and 2 for the reference edge itself, or -1 for a vertex of the incident polygon that didn't need clipping. The incident feature is the index of the incident polygon edge the point lies on (vertex i starts edge i). Clipping can also cut a segment that runs along an earlier clip plane, and then the incident feature is -1 - that plane's index. Pass a ManifoldCache to carry impulses over from the last frame. """
+    def __init__(self, polyA, polyB, normal, penetrationDepth, cache=None, metrics=None):
         self.polygonA = polyA
         self.polygonB = polyB
         self.polyAPoints = polyA.getTransformedPoints()[0]
         self.polyBPoints = polyB.getTransformedPoints()[0]
         self.polyAEdges = polyA.getEdgeList()
         self.polyBEdges = polyB.getEdgeList()
+        #Unit edge normals, cached on the polygons and indexed by each edge's start index
+        self.polyANormals = polyA.getEdgeNormals()
+        self.polyBNormals = polyB.getEdgeNormals()
         self.TOLERANCE = 0.0001
         self.normal = normal
         self.penetrationDepth = penetrationDepth
+        self.cache = cache
+        self.metrics = metrics
+        self.manifold = None
+        self.numClipPasses = 0
 
 
     def __calculateIntersectionPoint(self, p1, p2, p3, p4):
@@ -33,12 +77,12 @@ class SutherlandHodgemanAlgorithm:
         polyASignificantVertices = set()
         polyBSignificantVertices = set()
 
-        #This part is a bit clunky, need to rewrite it
-        maxADotProduct = max(self.polyAPoints, key=lambda pt: pt.dot(normal *-1.0)).dot(normal *-1.0)
-        maxBDotProduct = max(self.polyBPoints, key=lambda pt: pt.dot(normal)).dot(normal)
+        #The dots with the reversed normal are done with dotNegated, so no negated copies get made per vertex
+        maxADotProduct = max(pt.dotNegated(normal) for pt in self.polyAPoints)
+        maxBDotProduct = max(pt.dot(normal) for pt in self.polyBPoints)
 
         for vertex in self.polyAPoints:
-            if vertex.dot(normal * -1.0) == maxADotProduct:
+            if vertex.dotNegated(normal) == maxADotProduct:
                 polyASignificantVertices.add(vertex)
 
         for vertex in self.polyBPoints:
@@ -60,11 +104,11 @@ class SutherlandHodgemanAlgorithm:
 
         #We derive the reference face by looking at the one closest
         #to parallel with the normal
-        a_derived_edge = max(polyACandidateEdges, key=lambda edge: edge.getNormal(self.polyAPoints).dot(normal * -1.0))
-        b_derived_edge = max(polyBCandidateEdges, key=lambda edge: edge.getNormal(self.polyBPoints).dot(normal))
+        a_derived_edge = max(polyACandidateEdges, key=lambda edge: self.polyANormals[edge.startIndex].dotNegated(normal))
+        b_derived_edge = max(polyBCandidateEdges, key=lambda edge: self.polyBNormals[edge.startIndex].dot(normal))
 
-        a_closeness = abs(a_derived_edge.getNormal(self.polyAPoints).dot(normal * -1.0))
-        b_closeness = abs(b_derived_edge.getNormal(self.polyBPoints).dot(normal))
+        a_closeness = abs(self.polyANormals[a_derived_edge.startIndex].dotNegated(normal))
+        b_closeness = abs(self.polyBNormals[b_derived_edge.startIndex].dot(normal))
 
         referenceEdge = None
         incidentEdge = None
@@ -81,81 +125,255 @@ class SutherlandHodgemanAlgorithm:
 
         return (referenceEdge, incidentEdge, referenceFrom)
 
-    def __clip(self, to_clip, clipEdge, clipPolygonPoints, invert=False):
-        temp_list = [vert for vert in to_clip]
+    def __clip(self, to_clip, clipEdge, clipPolygonPoints, clipPolygonNormals, plane, referenceIndex, invert=False):
+        #Each entry is (point, incident feature of the segment from it to the next point, feature id)
+        temp_list = [entry for entry in to_clip]
         temp_output = []
         numPoints = len(temp_list)
-        edgeNormal = clipEdge.getNormal(clipPolygonPoints)
+        edgeNormal = clipPolygonNormals[clipEdge.startIndex]
 
+        #The normal belongs to the polygon's cache, so this has to make a new vector rather than flip it in place
         if invert is True:
-            edgeNormal = edgeNormal * -1.0
+            edgeNormal = -edgeNormal
 
         startVertex = clipPolygonPoints[clipEdge.startIndex]
         endVertex = clipPolygonPoints[clipEdge.endIndex]
 
+        #Which side of the clip edge each point is on, worked out once per point on the coordinates
+        (normalX, normalY, startX, startY) = (edgeNormal.x, edgeNormal.y, startVertex.x, startVertex.y)
+        inside = [(point.x - startX) * normalX + (point.y - startY) * normalY < 0 for (point, feature, featureId) in temp_list]
+
         for i in range(0, numPoints):
             
             startIndex = i %  numPoints
             endIndex = (i + 1) % numPoints
 
-            firstVertex = temp_list[startIndex]
-            secondVertex = temp_list[endIndex]
+            (firstVertex, firstFeature, firstId) = temp_list[startIndex]
+            secondEntry = temp_list[endIndex]
+            secondVertex = secondEntry[0]
 
-            firstVertexInside = (firstVertex - startVertex).dot(edgeNormal) < 0
-            secondVertexInside = (secondVertex - startVertex).dot(edgeNormal) < 0
+            firstVertexInside = inside[startIndex]
+            secondVertexInside = inside[endIndex]
 
             if firstVertexInside and secondVertexInside:
                 #If both vertices are inside, we only need the second one
-                temp_output.append(secondVertex)
+                temp_output.append(secondEntry)
             elif not firstVertexInside and not secondVertexInside:
                 #If neither vertex is inside, we discard them
                 pass
             elif firstVertexInside and not secondVertexInside:
                 #If the first vertex is inside and the second is outside
                 #we calculate a new point, the intersection of the
-                #line between the two vertices with the clip edge
+                #line between the two vertices with the clip edge.
+                #The outline carries on along the clip edge from here
                 new_point = self.__calculateIntersectionPoint(firstVertex, secondVertex, startVertex, endVertex)
-                temp_output.append(new_point)
+                temp_output.append((new_point, -1 - plane, (referenceIndex, firstFeature, plane)))
             elif not firstVertexInside and secondVertexInside:
                 new_point = self.__calculateIntersectionPoint(firstVertex, secondVertex, startVertex, endVertex)
-                temp_output.append(new_point)
-                temp_output.append(secondVertex)
+                temp_output.append((new_point, firstFeature, (referenceIndex, firstFeature, plane)))
+                temp_output.append(secondEntry)
 
-        temp_list = [point for point in temp_output]
+        temp_list = [entry for entry in temp_output]
        
         return temp_list
 
         
     def calculate(self):
+        """Returns the list of contact points. The points with their feature ids are left in self.manifold, which
+        has had the impulses carried over from the cache if there is one"""
+        if self.metrics is None:
+            return self.__calculate()
 
-        (referenceEdge, incidentEdge, referenceFrom) = self.__findSignificantEdges(self.normal)
-        points_to_clip = []
-        clipped = []
-        
-        if referenceFrom == 'A':
-            points_to_clip = [point for point in self.polyBPoints]
-            adjacents = self.polyAEdges.getAdjacentEdges(referenceEdge, self.polyAPoints)
-
-            #We clip our incident polygon with the adjacent edges of the reference polygon
-            for edge in adjacents:
-                points_to_clip = self.__clip(points_to_clip, edge, self.polyAPoints, False)
-
-            #then we only keep the vertices that are inside the reference polygon
-            clipped = self.__clip(points_to_clip, referenceEdge, self.polyAPoints, False)
+        start = time.perf_counter()
+        result = self.__calculate()
+        self.metrics.record('sha', time.perf_counter() - start, {'clipPasses': self.numClipPasses, 'contacts': len(result)})
+        return result
 
+    def __calculate(self):
+        (referenceEdge, incidentEdge, referenceFrom) = self.__findSignificantEdges(self.normal)
+        referenceIndex = referenceEdge.startIndex
 
+        if referenceFrom == 'A':
+            (referencePoints, referenceNormals, referenceEdges, incidentPoints) = (self.polyAPoints, self.polyANormals, self.polyAEdges, self.polyBPoints)
         else:
-            points_to_clip = [point for point in self.polyAPoints]
-            adjacents = self.polyBEdges.getAdjacentEdges(referenceEdge, self.polyBPoints)
-
-            for edge in adjacents:
-                points_to_clip = self.__clip(points_to_clip, edge, self.polyBPoints, False)
-
-            clipped = self.__clip(points_to_clip, referenceEdge, self.polyBPoints, False)
+            (referencePoints, referenceNormals, referenceEdges, incidentPoints) = (self.polyBPoints, self.polyBNormals, self.polyBEdges, self.polyAPoints)
+
+        points_to_clip = [(point, i, (referenceIndex, i, -1)) for (i, point) in enumerate(incidentPoints)]
+        adjacents = referenceEdges.getAdjacentEdges(referenceEdge, referencePoints)
+
+        #We clip our incident polygon with the adjacent edges of the reference polygon
+        for (plane, edge) in enumerate(adjacents):
+            points_to_clip = self.__clip(points_to_clip, edge, referencePoints, referenceNormals, plane, referenceIndex, False)
+
+        #then we only keep the vertices that are inside the reference polygon
+        clipped = self.__clip(points_to_clip, referenceEdge, referencePoints, referenceNormals, 2, referenceIndex, False)
+        self.numClipPasses = len(adjacents) + 1
+
+        #How far each point is outside the reference edge, so penetrating points come out negative
+        referenceNormal = referenceNormals[referenceIndex]
+        referenceStart = referencePoints[referenceEdge.startIndex]
+        contacts = [ContactPoint(point, featureId, (point.x - referenceStart.x) * referenceNormal.x + (point.y - referenceStart.y) * referenceNormal.y) for (point, feature, featureId) in clipped]
+
+        self.manifold = ContactManifold(self.normal, referenceFrom, contacts)
+        if self.cache is not None:
+            self.cache.update(self.polygonA, self.polygonB, self.manifold)
+
+        return [point for (point, feature, featureId) in clipped]
+
+class BatchSutherlandHodgemanAlgorithm:
+    """Finds the contact points of many colliding pairs at once. Polygons is a list of polygons, pairs is a (k, 2) array
+    of indices into it, and normals and depths are the (k, 2) and (k,) results of the narrow phase for those pairs, such
+    as the colliding rows from BatchSeparatingAxisTest. The points and feature ids of each pair match
+    SutherlandHodgemanAlgorithm(polygons[a], polygons[b], normal, depth).calculate() and its manifold, but every pair is
+    clipped together with array operations and the contacts come back in flat arrays."""
+    def __init__(self, polygons, pairs, normals, depths, chunkSize=2048):
+        self.polygons = polygons
+        self.pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+        self.normals = np.asarray(normals, dtype=np.float64).reshape(-1, 2)
+        self.depths = np.asarray(depths, dtype=np.float64).reshape(-1)
+        #Each clip pass builds two candidate points per edge of every pair, so we work through the pairs in chunks to cap memory
+        self.chunkSize = chunkSize
+        (self.points, self.edgeNormals, self.counts) = packPolygons(polygons)
+
+    def __findSignificantEdges(self, points, edgeNormals, counts, nx, ny, sign):
+        #Same rule as the single pair version. The significant vertices are the ones furthest along the normal (or against
+        #it for A), the candidate edges are the ones either side of them, and the one whose normal is closest to the
+        #collision normal wins. Vertex i is on edges i - 1 and i, so edge i is a candidate if vertex i or i + 1 is significant
+        columns = np.arange(points.shape[1])
+        valid = columns < counts[:, None]
+        nextColumns = np.where(columns + 1 < counts[:, None], columns + 1, 0)
+        rows = np.arange(len(counts))[:, None]
+
+        if sign < 0:
+            dots = -(points[:, :, 0] * nx[:, None] + points[:, :, 1] * ny[:, None])
+            scores = -(edgeNormals[:, :, 0] * nx[:, None] + edgeNormals[:, :, 1] * ny[:, None])
+        else:
+            dots = points[:, :, 0] * nx[:, None] + points[:, :, 1] * ny[:, None]
+            scores = edgeNormals[:, :, 0] * nx[:, None] + edgeNormals[:, :, 1] * ny[:, None]
+
+        dots = np.where(valid, dots, -np.inf)
+        significant = valid & (dots == dots.max(axis=1)[:, None])
+        candidates = significant | significant[rows, nextColumns]
+
+        #If two candidates are exactly as close, the single pair version takes whichever its set gives it first, we take the lower index
+        edges = np.argmax(np.where(candidates, scores, -np.inf), axis=1)
+        closeness = np.abs(scores[rows[:, 0], edges])
+        return (edges, closeness)
+
+    def __clip(self, state, plane, starts, ends, clipNormals):
+        #Each point of the clipped outlines carries the incident feature of the segment from it to the next point, and
+        #its feature id. Working along each outline, every edge adds the point where it crosses the clip edge if it does,
+        #then its second point if that's inside, which is the same order the single pair version adds them in
+        (points, counts, features, idFeatures, idPlanes) = state
+        (numRows, numColumns) = points.shape[:2]
+        rows = np.arange(numRows)[:, None]
+        columns = np.arange(numColumns)
+        valid = columns < counts[:, None]
+        nextColumns = np.where(columns + 1 < counts[:, None], columns + 1, 0)
+
+        (x, y) = (points[:, :, 0], points[:, :, 1])
+        inside = (x - starts[:, 0, None]) * clipNormals[:, 0, None] + (y - starts[:, 1, None]) * clipNormals[:, 1, None] < 0
+        nextInside = inside[rows, nextColumns]
+        nextPoints = points[rows, nextColumns]
+        crossing = valid & (inside != nextInside)
+
+        #The intersection of the line through each edge with the line through the clip edge, written the same way as
+        #the single pair version so the points come out the same. Edges that don't cross can divide by zero, but get dropped
+        (x2, y2) = (nextPoints[:, :, 0], nextPoints[:, :, 1])
+        (x3, y3, x4, y4) = (starts[:, 0, None], starts[:, 1, None], ends[:, 0, None], ends[:, 1, None])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denominator = (x - x2) * (y3 - y4) - (y - y2) * (x3 - x4)
+            commonA = (x * y2 - y * x2)
+            commonB = (x3 * y4 - y3 * x4)
+            intersections = np.stack((commonA * (x3 - x4) - (x - x2) * commonB, commonA * (y3 - y4) - (y - y2) * commonB), axis=2) / denominator[:, :, None]
+
+        #Leaving the clip region the outline carries on along the clip edge, coming back in it carries on along the edge
+        candidatePoints = np.stack((intersections, nextPoints), axis=2).reshape(numRows, 2 * numColumns, 2)
+        candidateValid = np.stack((crossing, valid & nextInside), axis=2).reshape(numRows, -1)
+        candidateFeatures = np.stack((np.where(inside, -1 - plane, features), features[rows, nextColumns]), axis=2).reshape(numRows, -1)
+        candidateIdFeatures = np.stack((features, idFeatures[rows, nextColumns]), axis=2).reshape(numRows, -1)
+        candidateIdPlanes = np.stack((np.full(features.shape, plane), idPlanes[rows, nextColumns]), axis=2).reshape(numRows, -1)
+
+        #Squeeze the kept candidates to the front of each row, keeping their order. The dropped ones are zeroed first, so
+        #the padding past each row's count never has the NaNs from the divisions in it
+        candidatePoints[~candidateValid] = 0.0
+        counts = candidateValid.sum(axis=1)
+        numColumns = int(counts.max()) if numRows > 0 else 0
+        order = np.argsort(~candidateValid, axis=1, kind='stable')[:, :numColumns]
+
+        return (candidatePoints[rows, order], counts, candidateFeatures[rows, order], candidateIdFeatures[rows, order], candidateIdPlanes[rows, order])
+
+    def __calculateChunk(self, indicesA, indicesB, collisionNormals):
+        maxCount = max(int(self.counts[indicesA].max()), int(self.counts[indicesB].max()))
+        (pointsA, pointsB) = (self.points[indicesA, :maxCount], self.points[indicesB, :maxCount])
+        (normalsA, normalsB) = (self.edgeNormals[indicesA, :maxCount], self.edgeNormals[indicesB, :maxCount])
+        (countsA, countsB) = (self.counts[indicesA], self.counts[indicesB])
+        (nx, ny) = (collisionNormals[:, 0], collisionNormals[:, 1])
+
+        (edgesA, closenessA) = self.__findSignificantEdges(pointsA, normalsA, countsA, nx, ny, -1)
+        (edgesB, closenessB) = self.__findSignificantEdges(pointsB, normalsB, countsB, nx, ny, 1)
+
+        referenceFromA = closenessA > closenessB
+        referenceIndices = np.where(referenceFromA, edgesA, edgesB)
+        referencePoints = np.where(referenceFromA[:, None, None], pointsA, pointsB)
+        referenceNormals = np.where(referenceFromA[:, None, None], normalsA, normalsB)
+        referenceCounts = np.where(referenceFromA, countsA, countsB)
+        rows = np.arange(len(indicesA))
+
+        columns = np.broadcast_to(np.arange(maxCount), (len(indicesA), maxCount))
+        state = (np.where(referenceFromA[:, None, None], pointsB, pointsA), np.where(referenceFromA, countsB, countsA), columns, columns, np.full(columns.shape, -1))
+
+        #The edge after the reference edge is plane 0, the one before it plane 1, then the reference edge itself is plane 2
+        planeEdges = ((referenceIndices + 1) % referenceCounts, (referenceIndices - 1) % referenceCounts, referenceIndices)
+        for (plane, edges) in enumerate(planeEdges):
+            state = self.__clip(state, plane, referencePoints[rows, edges], referencePoints[rows, (edges + 1) % referenceCounts], referenceNormals[rows, edges])
+
+        (points, counts, features, idFeatures, idPlanes) = state
+        referenceStarts = referencePoints[rows, referenceIndices]
+        referenceNormal = referenceNormals[rows, referenceIndices]
+        separations = (points[:, :, 0] - referenceStarts[:, 0, None]) * referenceNormal[:, 0, None] + (points[:, :, 1] - referenceStarts[:, 1, None]) * referenceNormal[:, 1, None]
+
+        featureIds = np.stack((np.broadcast_to(referenceIndices[:, None], idFeatures.shape), idFeatures, idPlanes), axis=2)
+        valid = np.arange(points.shape[1]) < counts[:, None]
+        return (points[valid], featureIds[valid], separations[valid], counts, referenceFromA)
 
-        return clipped
+    def calculate(self):
+        """Returns (points, featureIds, separations, offsets, referenceFromA). The contacts of pair i are rows offsets[i] to
+        offsets[i + 1] of the (m, 2) points, (m, 3) feature ids and (m,) separations, and referenceFromA is a (k,) bool
+        array saying which polygon the reference edge of each pair was on"""
+        numPairs = len(self.pairs)
+        counts = np.zeros(numPairs, dtype=np.intp)
+        referenceFromA = np.zeros(numPairs, dtype=bool)
+        chunkResults = []
+
+        #Sorting the pairs by size means small polygons aren't padded out to the size of the biggest one in the batch
+        pairSizes = np.maximum(self.counts[self.pairs[:, 0]], self.counts[self.pairs[:, 1]])
+        order = np.argsort(pairSizes, kind='stable')
+
+        for start in range(0, numPairs, self.chunkSize):
+            chunk = order[start:start + self.chunkSize]
+            (chunkPoints, chunkIds, chunkSeparations, counts[chunk], referenceFromA[chunk]) = self.__calculateChunk(self.pairs[chunk, 0], self.pairs[chunk, 1], self.normals[chunk])
+            chunkResults.append((chunk, chunkPoints, chunkIds, chunkSeparations))
+
+        offsets = np.zeros(numPairs + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        points = np.empty((offsets[-1], 2))
+        featureIds = np.empty((offsets[-1], 3), dtype=np.intp)
+        separations = np.empty(offsets[-1])
+
+        #The chunks came out in size order, so each chunk's rows are put back where their pairs are in the flat arrays
+        for (chunk, chunkPoints, chunkIds, chunkSeparations) in chunkResults:
+            chunkCounts = counts[chunk]
+            chunkStarts = np.cumsum(chunkCounts) - chunkCounts
+            rows = np.repeat(offsets[chunk] - chunkStarts, chunkCounts) + np.arange(len(chunkPoints))
+            (points[rows], featureIds[rows], separations[rows]) = (chunkPoints, chunkIds, chunkSeparations)
+
+        return (points, featureIds, separations, offsets, referenceFromA)
 
 if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
     polyA = Polygon(Vector(165.0, 175.0))
     polyA.addPoint(Vector(-60.0, -60.0))
     polyA.addPoint(Vector(-60.0, 60.0))
@@ -192,6 +410,7 @@ if __name__ == '__main__':
     normal_vector = Vector()
 
     font = pygame.font.SysFont(None, 24)
+    manifoldCache = ManifoldCache()
 
     while running:
         for event in pygame.event.get():
@@ -235,11 +454,14 @@ if __name__ == '__main__':
             screen.blit(normDirText, (500, 530))
 
 
-            pointGenerator = SutherlandHodgemanAlgorithm(polyA, polyB, normal_vector, penetrationDepth)
-            collisionPoints = pointGenerator.calculate()
+            pointGenerator = SutherlandHodgemanAlgorithm(polyA, polyB, normal_vector, penetrationDepth, manifoldCache)
+            pointGenerator.calculate()
 
-            for point in collisionPoints:
-                drawCircle(screen, point, 3.0, color=(0, 0, 255))
+            #Points that were matched up with last frame's are drawn in green
+            for contact in pointGenerator.manifold.points:
+                drawCircle(screen, contact.position, 3.0, color=(0, 255, 0) if contact.isPersistent else (0, 0, 255))
+        else:
+            manifoldCache.evict(polyA, polyB)
 
         algoText = font.render("Using: SAT" if algorithm == 0 else "Using: EPA", True, (255, 255, 255))
         screen.blit(algoText, (500, 560))
@@ -0,0 +1,87 @@
+from utils.utilbase import *
+import gjk
+import epa
+import sat
+import math
+import random
+
+def makeBox(x, y):
+    poly = Polygon(Vector(x, y))
+    poly.addPoint(Vector(-10.0, -10.0))
+    poly.addPoint(Vector(-10.0, 10.0))
+    poly.addPoint(Vector(10.0, 10.0))
+    poly.addPoint(Vector(10.0, -10.0))
+    return poly
+
+def test_overlapping_boxes_at_same_height():
+    #The support points of boxes at the same height tie along the x axis, which once put the origin right on GJK's first segment
+    for x in (5.0, 15.0, 19.9):
+        (polyA, polyB) = (makeBox(0.0, 0.0), makeBox(x, 0.0))
+        assert sat.SeparatingAxisTest(polyA, polyB).calculate()[0]
+        assert gjk.GJKAlgorithm(polyA, polyB).calculate()
+
+        (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(makeBox(0.0, 0.0), makeBox(x, 0.0)).calculate()
+        assert isColliding
+        assert abs(depth - (20.0 - x)) < 0.01
+        assert abs(abs(normal.x) - 1.0) < 1e-9 and abs(normal.y) < 1e-9
+
+def test_support_ties_match_argmax():
+    poly = makeBox(0.0, 0.0)
+    for rotation in (0.0, 0.5 * math.pi, math.pi, 1.5 * math.pi):
+        poly.rotation = rotation
+        for (directionX, directionY) in ((1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)):
+            points = poly.getTransformedArray()
+            expected = int(np.argmax(points[:, 0] * directionX + points[:, 1] * directionY))
+            assert poly.getSupportIndex(directionX, directionY) == expected
+
+def makeRandomPolygon(rng, numPoints, radius, clockwise):
+    poly = Polygon(Vector(rng.uniform(-50.0, 50.0), rng.uniform(-50.0, 50.0)), rng.uniform(0.0, 2.0 * math.pi))
+    angle = 2.0 * math.pi / numPoints
+    for i in range(numPoints):
+        theta = angle * (i + rng.uniform(-0.3, 0.3))
+        poly.addPoint(Vector(radius * math.cos(theta), (-1.0 if clockwise else 1.0) * radius * math.sin(theta)))
+    return poly
+
+def test_support_matches_argmax():
+    rng = random.Random(1)
+    for numPoints in (4, 5, 16, 64, 256):
+        for clockwise in (False, True):
+            poly = makeRandomPolygon(rng, numPoints, 40.0, clockwise)
+            points = poly.getTransformedArray()
+            for i in range(200):
+                (directionX, directionY) = (rng.uniform(-1.0, 1.0), rng.uniform(-1.0, 1.0))
+                expected = int(np.argmax(points[:, 0] * directionX + points[:, 1] * directionY))
+                assert poly.getSupportIndex(directionX, directionY) == expected
+
+def test_support_never_falls_back_on_a_256_gon():
+    #GJK and EPA swing the search direction round a long way between calls, which is what used to defeat the climb
+    rng = random.Random(2)
+    terrain = makeRandomPolygon(rng, 256, 200.0, False)
+    for i in range(50):
+        rock = makeRandomPolygon(rng, 8, 20.0, False)
+        rock.origin = terrain.origin + Vector(rng.uniform(-220.0, 220.0), rng.uniform(-220.0, 220.0))
+        gjk.GJKAlgorithm(terrain, rock).calculate()
+        epa.ExpandingPolytopeAlgorithm(terrain, rock).calculate()
+
+    assert terrain.numSupportFallbacks == 0
+
+def makeDiamond(x, y):
+    poly = Polygon(Vector(x, y))
+    poly.addPoint(Vector(10.0, 0.0))
+    poly.addPoint(Vector(0.0, 10.0))
+    poly.addPoint(Vector(-10.0, 0.0))
+    poly.addPoint(Vector(0.0, -10.0))
+    return poly
+
+def test_origin_on_first_segment():
+    #Along the x axis the first two support points of these diamonds are on either side of the origin, in line with it
+    for x in (5.0, 15.0, 20.0):
+        algorithm = gjk.GJKAlgorithm(makeDiamond(0.0, 0.0), makeDiamond(x, 0.0))
+        assert algorithm.calculate()
+        assert not algorithm.hitIterationLimit
+
+        (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(makeDiamond(0.0, 0.0), makeDiamond(x, 0.0)).calculate()
+        assert isColliding
+        assert abs(depth - (20.0 - x) * math.sqrt(0.5)) < 0.01
+
+    assert not gjk.GJKAlgorithm(makeDiamond(0.0, 0.0), makeDiamond(25.0, 0.0)).calculate()
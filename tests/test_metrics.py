@@ -0,0 +1,48 @@
+from utils.utilbase import *
+from utils.metrics import CollisionMetrics
+import gc
+import io
+import json
+import weakref
+
+def makeSquare(x, y):
+    poly = Polygon(Vector(x, y))
+    for (pointX, pointY) in ((-1.0, -1.0), (-1.0, 1.0), (1.0, 1.0), (1.0, -1.0)):
+        poly.addPoint(Vector(pointX, pointY))
+    return poly
+
+def test_samples_and_frames_are_bounded():
+    metrics = CollisionMetrics(maxSamples=50, maxFrames=4, maxFlagged=3)
+    for frame in range(10):
+        for call in range(20):
+            metrics.record('gjk', 0.001, {'iterations': call})
+            metrics.flag('gjk', 'iteration_limit', makeSquare(0.0, 0.0), makeSquare(1.0, 0.0))
+        assert metrics.endFrame()['gjk']['calls'] == 20
+
+    assert len(metrics.samples['gjk']['iterations']) == 50
+    assert len(metrics.samples['gjk']['seconds']) == 50
+    assert len(metrics.frames) == 4
+    assert len(metrics.flagged) == 3
+    assert metrics.numFrames == 10
+
+    (counts, binEdges) = metrics.getHistogram('gjk', 'iterations', bins=5)
+    assert counts.sum() == 50
+
+def test_flag_keeps_a_copy_of_the_points():
+    metrics = CollisionMetrics()
+    (polyA, polyB) = (makeSquare(0.0, 0.0), makeSquare(5.0, 0.0))
+    metrics.flag('epa', 'degenerate', polyA, polyB)
+
+    #The metrics shouldn't keep the polygons alive
+    reference = weakref.ref(polyA)
+    del polyA
+    gc.collect()
+    assert reference() is None
+
+    (frame, algorithm, reason, pointsA, pointsB) = metrics.flagged[0]
+    assert (frame, algorithm, reason) == (0, 'epa', 'degenerate')
+    assert sorted(pointsB.tolist()) == [[4.0, -1.0], [4.0, 1.0], [6.0, -1.0], [6.0, 1.0]]
+
+    outputFile = io.StringIO()
+    metrics.exportHistograms(outputFile)
+    assert json.loads(outputFile.getvalue())['flagged'][0]['pointsB'] == pointsB.tolist()
@@ -0,0 +1,124 @@
+from utils.utilbase import *
+from utils.metrics import CollisionMetrics
+from pipeline import CollisionPipeline
+import sat
+import epa
+import gjk
+import sha
+import math
+import random
+import pytest
+
+def makeRandomPolygons(seed, numPolygons, size):
+    rng = random.Random(seed)
+    polygons = []
+    for i in range(numPolygons):
+        poly = Polygon(Vector(rng.uniform(0.0, size), rng.uniform(0.0, size)), rng.uniform(0.0, 2.0 * math.pi))
+        numPoints = rng.randint(3, 10)
+        angle = 2.0 * math.pi / numPoints
+        radius = rng.uniform(5.0, 25.0)
+        for j in range(0, -numPoints, -1):
+            theta = angle * (j + rng.uniform(-0.3, 0.3))
+            poly.addPoint(Vector(radius * math.cos(theta), radius * math.sin(theta)))
+        polygons.append(poly)
+    return polygons
+
+def getAllPairs(polygons):
+    return [(polygons[i], polygons[j]) for i in range(len(polygons)) for j in range(i + 1, len(polygons))]
+
+def getUnbatchedResults(pairs, narrowPhase):
+    """Runs each pair through the single pair narrow phase and clipper, the slow way"""
+    results = []
+    for (polyA, polyB) in pairs:
+        if not polyA.getAABB().overlaps(polyB.getAABB()):
+            continue
+        if narrowPhase == 'sat':
+            (isColliding, depth, normal) = sat.SeparatingAxisTest(polyA, polyB).calculate()
+        else:
+            (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(polyA, polyB).calculate()
+        if isColliding:
+            algorithm = sha.SutherlandHodgemanAlgorithm(polyA, polyB, normal, depth)
+            results.append(((polyA, polyB), depth, normal, algorithm.calculate(), algorithm.manifold))
+    return results
+
+def test_sat_matches_unbatched_stages():
+    polygons = makeRandomPolygons(5, 250, 300.0)
+    pairs = getAllPairs(polygons)
+    expected = getUnbatchedResults(pairs, 'sat')
+    results = list(CollisionPipeline('sat', chunkSize=500).process(pairs))
+    assert len(expected) > 100 and len(results) == len(expected)
+
+    for (((pair, depth, normal, contactPoints), (expectedPair, expectedDepth, expectedNormal, expectedPoints, manifold))) in zip(results, expected):
+        assert pair == expectedPair
+        #The batched SAT sums its projections in a different order, so everything downstream can be a rounding error apart
+        assert abs(depth - expectedDepth) < 1e-9
+        assert abs(normal.x - expectedNormal.x) < 1e-9 and abs(normal.y - expectedNormal.y) < 1e-9
+        assert len(contactPoints) == len(expectedPoints)
+        for (point, expectedPoint) in zip(contactPoints, expectedPoints):
+            assert abs(point.x - expectedPoint.x) < 1e-6 and abs(point.y - expectedPoint.y) < 1e-6
+
+def test_epa_matches_unbatched_stages():
+    polygons = makeRandomPolygons(6, 120, 200.0)
+    pairs = getAllPairs(polygons)
+    expected = getUnbatchedResults(pairs, 'epa')
+    results = list(CollisionPipeline('epa', chunkSize=300).process(pairs))
+    assert len(expected) > 50 and len(results) == len(expected)
+
+    #EPA runs one pair at a time in the pipeline too, and the batched clipper matches the single pair one exactly
+    for (((pair, depth, normal, contactPoints), (expectedPair, expectedDepth, expectedNormal, expectedPoints, manifold))) in zip(results, expected):
+        assert pair == expectedPair and depth == expectedDepth
+        assert normal.asList2() == expectedNormal.asList2()
+        assert [point.asList2() for point in contactPoints] == [point.asList2() for point in expectedPoints]
+
+def test_manifold_cache_and_metrics_on_batched_path():
+    polygons = makeRandomPolygons(8, 100, 200.0)
+    pairs = getAllPairs(polygons)
+    expected = getUnbatchedResults(pairs, 'epa')
+    manifoldCache = sha.ManifoldCache()
+    metrics = CollisionMetrics()
+    collisionPipeline = CollisionPipeline('epa', chunkSize=200, manifoldCache=manifoldCache, metrics=metrics)
+
+    results = list(collisionPipeline.process(pairs))
+    assert len(results) == len(expected) > 20
+    assert len(manifoldCache) == len(expected)
+
+    for ((polyA, polyB), depth, normal, expectedPoints, expectedManifold) in expected:
+        manifold = manifoldCache.get(polyA, polyB)
+        assert manifold.referenceFrom == expectedManifold.referenceFrom
+        assert [point.featureId for point in manifold.points] == [point.featureId for point in expectedManifold.points]
+        assert [point.separation for point in manifold.points] == [point.separation for point in expectedManifold.points]
+        assert not any(point.isPersistent for point in manifold.points)
+        for point in manifold.points:
+            point.normalImpulse = 1.5
+
+    #Nothing moved, so the second run matches every point to the first and carries the impulses over
+    list(collisionPipeline.process(pairs))
+    for ((polyA, polyB), depth, normal, expectedPoints, expectedManifold) in expected:
+        for point in manifoldCache.get(polyA, polyB).points:
+            assert point.isPersistent and point.normalImpulse == 1.5
+
+    frame = metrics.endFrame()
+    assert frame['epa']['calls'] == 2 * sum(1 for (polyA, polyB) in pairs if polyA.getAABB().overlaps(polyB.getAABB()))
+    assert frame['sha_batch']['pairs'] == 2 * len(expected)
+    assert frame['sha_batch']['contacts'] == 2 * sum(len(expectedPoints) for (pair, depth, normal, expectedPoints, manifold) in expected)
+
+def test_sat_metrics_are_recorded_per_chunk():
+    polygons = makeRandomPolygons(9, 60, 150.0)
+    pairs = getAllPairs(polygons)
+    metrics = CollisionMetrics()
+    results = list(CollisionPipeline('sat', chunkSize=100, boundsTest=False, metrics=metrics).process(pairs))
+
+    frame = metrics.endFrame()
+    assert frame['sat_batch']['calls'] == math.ceil(len(pairs) / 100)
+    assert frame['sat_batch']['pairs'] == len(pairs)
+    assert frame['sat_batch']['colliding'] == len(results)
+
+def test_gjk_cache_with_sat_raises():
+    with pytest.raises(ValueError):
+        CollisionPipeline('sat', gjkCache=gjk.GJKCache())
+
+    #Switching the narrow phase after construction is caught when the pairs are processed
+    collisionPipeline = CollisionPipeline('epa', gjkCache=gjk.GJKCache())
+    collisionPipeline.narrowPhase = 'sat'
+    with pytest.raises(ValueError):
+        collisionPipeline.processChunks([])
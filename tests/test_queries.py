@@ -0,0 +1,96 @@
+from utils.utilbase import *
+from bvh import AABBTreeBroadPhase
+import sat
+import math
+import random
+
+def makeRandomPolygons(seed, numPolygons, size):
+    rng = random.Random(seed)
+    polygons = []
+    for i in range(numPolygons):
+        poly = Polygon(Vector(rng.uniform(0.0, size), rng.uniform(0.0, size)), rng.uniform(0.0, 2.0 * math.pi))
+        numPoints = rng.randint(3, 10)
+        angle = 2.0 * math.pi / numPoints
+        radius = rng.uniform(5.0, 25.0)
+        for j in range(0, -numPoints, -1):
+            theta = angle * (j + rng.uniform(-0.3, 0.3))
+            poly.addPoint(Vector(radius * math.cos(theta), radius * math.sin(theta)))
+        polygons.append(poly)
+    return polygons
+
+def makeBroadPhase(polygons):
+    #Every third polygon goes in the static tree, so both trees get searched
+    broadPhase = AABBTreeBroadPhase()
+    for (i, poly) in enumerate(polygons):
+        broadPhase.insert(poly, i % 3 == 0)
+    return broadPhase
+
+def makeBox(aabb):
+    #Polygons are placed by their centroid, so the corners are given around the middle of the box
+    (halfWidth, halfHeight) = ((aabb.maxX - aabb.minX) * 0.5, (aabb.maxY - aabb.minY) * 0.5)
+    center = Vector(aabb.minX + halfWidth, aabb.minY + halfHeight)
+    return Polygon.fromArray([[-halfWidth, -halfHeight], [-halfWidth, halfHeight], [halfWidth, halfHeight], [halfWidth, -halfHeight]], center)
+
+def test_ray_cast_matches_brute_force():
+    polygons = makeRandomPolygons(11, 200, 400.0)
+    broadPhase = makeBroadPhase(polygons)
+    rng = random.Random(12)
+
+    numHits = 0
+    for k in range(300):
+        start = Vector(rng.uniform(-50.0, 450.0), rng.uniform(-50.0, 450.0))
+        end = Vector(rng.uniform(-50.0, 450.0), rng.uniform(-50.0, 450.0))
+        hits = [(hit[0], poly) for poly in polygons for hit in [poly.rayCast(start, end)] if hit is not None]
+
+        result = broadPhase.rayCast(start, end)
+        if len(hits) == 0:
+            assert result is None
+            continue
+
+        numHits += 1
+        (fraction, poly) = min(hits, key=lambda hit: hit[0])
+        assert result[0] is poly and result[1] == fraction
+        assert abs(result[3].x - (start.x + (end.x - start.x) * fraction)) < 1e-9
+    assert numHits > 100
+
+def test_query_point_matches_brute_force():
+    polygons = makeRandomPolygons(13, 200, 400.0)
+    broadPhase = makeBroadPhase(polygons)
+    rng = random.Random(14)
+
+    numHits = 0
+    for k in range(1000):
+        point = Vector(rng.uniform(0.0, 400.0), rng.uniform(0.0, 400.0))
+        expected = set(poly for poly in polygons if poly.containsPoint(point))
+        assert set(broadPhase.queryPoint(point)) == expected
+        numHits += len(expected)
+    assert numHits > 100
+
+def test_query_region_matches_brute_force():
+    polygons = makeRandomPolygons(15, 200, 400.0)
+    broadPhase = makeBroadPhase(polygons)
+    rng = random.Random(16)
+
+    numBoundsOnly = 0
+    for k in range(300):
+        (x, y) = (rng.uniform(0.0, 400.0), rng.uniform(0.0, 400.0))
+        region = AABB(x, y, x + rng.uniform(1.0, 40.0), y + rng.uniform(1.0, 40.0))
+        box = makeBox(region)
+        expected = set(poly for poly in polygons if sat.SeparatingAxisTest(poly, box).calculate()[0])
+        assert set(broadPhase.queryRegion(region)) == expected
+        numBoundsOnly += sum(1 for poly in polygons if poly.getAABB().overlaps(region) and poly not in expected)
+
+    #Make sure some of the regions only overlapped bounding boxes, or this wouldn't test anything
+    assert numBoundsOnly > 10
+
+def test_query_region_misses_long_diagonal_polygon():
+    #A long thin polygon at 45 degrees has a bounding box that is mostly empty space
+    sliver = Polygon.fromArray([[-100.0, -2.0], [-100.0, 2.0], [100.0, 2.0], [100.0, -2.0]], Vector(0.0, 0.0), math.pi / 4.0)
+    broadPhase = AABBTreeBroadPhase()
+    broadPhase.insert(sliver)
+
+    corner = AABB(40.0, -70.0, 60.0, -50.0)
+    assert sliver.getAABB().overlaps(corner)
+    assert broadPhase.queryRegion(corner) == []
+    assert broadPhase.queryRegion(AABB(-5.0, -5.0, 5.0, 5.0)) == [sliver]
+    assert broadPhase.queryRegion(AABB(60.0, 60.0, 65.0, 65.0)) == [sliver]
@@ -0,0 +1,35 @@
+from utils.utilbase import *
+import sat
+import math
+import random
+
+def makeRandomPolygons(seed, numPolygons, size):
+    rng = random.Random(seed)
+    polygons = []
+    for i in range(numPolygons):
+        poly = Polygon(Vector(rng.uniform(0.0, size), rng.uniform(0.0, size)), rng.uniform(0.0, 2.0 * math.pi))
+        numPoints = rng.randint(3, 12)
+        angle = 2.0 * math.pi / numPoints
+        radius = rng.uniform(5.0, 25.0)
+        for j in range(0, -numPoints, -1):
+            theta = angle * (j + rng.uniform(-0.3, 0.3))
+            poly.addPoint(Vector(radius * math.cos(theta), radius * math.sin(theta)))
+        polygons.append(poly)
+    return polygons
+
+def test_batch_matches_single_pair():
+    polygons = makeRandomPolygons(3, 300, 300.0)
+    pairs = [(i, j) for i in range(len(polygons)) for j in range(i + 1, len(polygons)) if polygons[i].getAABB().overlaps(polygons[j].getAABB())]
+
+    (isColliding, depths, normals) = sat.BatchSeparatingAxisTest(polygons, pairs, chunkSize=64).calculate()
+    assert isColliding.sum() > 100 and (~isColliding).sum() > 100
+
+    for (k, (indexA, indexB)) in enumerate(pairs):
+        (expectedColliding, expectedDepth, expectedNormal) = sat.SeparatingAxisTest(polygons[indexA], polygons[indexB]).calculate()
+        assert bool(isColliding[k]) == expectedColliding
+        if expectedColliding:
+            #The projections are summed in a different order, so they can be a rounding error apart
+            assert abs(depths[k] - expectedDepth) < 1e-9
+            assert abs(normals[k][0] - expectedNormal.x) < 1e-9 and abs(normals[k][1] - expectedNormal.y) < 1e-9
+        else:
+            assert depths[k] == 0.0 and normals[k].tolist() == [0.0, 0.0]
@@ -0,0 +1,72 @@
+from utils.utilbase import *
+from scene import writeScene, loadScene, readSceneArrays, getSceneLayout, HEADER_DTYPE
+import math
+import random
+import pytest
+
+def makeScene(seed, numBodies):
+    #Half the bodies share one of a few shapes and the rest each have their own, so both ways of storing them get used
+    rng = random.Random(seed)
+    sharedShapes = [ConvexShape([[-s, -s], [-s, s], [s, s], [s, -s]]) for s in (1.0, 2.5, 4.0)]
+    polygons = []
+    for i in range(numBodies):
+        origin = Vector(rng.uniform(-100.0, 100.0), rng.uniform(-100.0, 100.0))
+        rotation = rng.uniform(0.0, 2.0 * math.pi)
+        if i % 2 == 0:
+            polygons.append(Polygon.fromShape(rng.choice(sharedShapes), origin, rotation))
+            continue
+
+        numPoints = rng.randint(3, 9)
+        radius = rng.uniform(1.0, 10.0)
+        points = [[radius * math.cos(-2.0 * math.pi * j / numPoints), radius * math.sin(-2.0 * math.pi * j / numPoints)] for j in range(numPoints)]
+        polygons.append(Polygon.fromArray(points, origin, rotation))
+    return polygons
+
+def test_write_and_load_round_trip(tmp_path):
+    polygons = makeScene(3, 50)
+    path = tmp_path / 'round_trip.scene'
+    writeScene(path, polygons)
+    loaded = loadScene(path)
+
+    assert len(loaded) == len(polygons)
+    for (poly, loadedPoly) in zip(polygons, loaded):
+        assert (loadedPoly.origin.x, loadedPoly.origin.y, loadedPoly.rotation) == (poly.origin.x, poly.origin.y, poly.rotation)
+        assert loadedPoly.shape.points.tolist() == poly.shape.points.tolist()
+        #The loaded shapes' centroids are worked out all at once, so they can be a rounding error away from the originals
+        assert np.allclose(loadedPoly.getTransformedArray(), poly.getTransformedArray(), rtol=0.0, atol=1e-9)
+
+    #Bodies that shared a shape when they were written share one when they are loaded
+    for i in range(len(polygons)):
+        for j in range(i + 1, len(polygons)):
+            assert (loaded[i].shape is loaded[j].shape) == (polygons[i].shape is polygons[j].shape)
+
+def test_truncated_file_raises(tmp_path):
+    path = tmp_path / 'truncated.scene'
+    writeScene(path, makeScene(4, 10))
+    data = path.read_bytes()
+    path.write_bytes(data[:-5])
+
+    with pytest.raises(ValueError, match='truncated'):
+        readSceneArrays(path)
+
+    path.write_bytes(data[:HEADER_DTYPE.itemsize - 1])
+    with pytest.raises(ValueError, match='too short'):
+        readSceneArrays(path)
+
+def test_bad_offsets_raise(tmp_path):
+    path = tmp_path / 'bad_offsets.scene'
+    writeScene(path, makeScene(5, 10))
+    (offsets, vertices, bodies) = readSceneArrays(path)
+    (numShapes, numVertices) = (len(offsets) - 1, len(vertices))
+    del offsets, vertices, bodies
+
+    #Swapping two of the inner offsets makes a shape with a negative number of vertices
+    (offsetsStart, verticesStart, bodiesStart, size) = getSceneLayout(numShapes, 10, numVertices)
+    data = bytearray(path.read_bytes())
+    offsets = np.frombuffer(data, dtype='<i8', count=numShapes + 1, offset=offsetsStart).copy()
+    (offsets[1], offsets[2]) = (offsets[2], offsets[1])
+    data[offsetsStart:verticesStart] = offsets.tobytes()
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match='offsets'):
+        readSceneArrays(path)
@@ -0,0 +1,109 @@
+from utils.utilbase import *
+import sat
+import sha
+import math
+import random
+
+def makeRandomPolygons(seed, numPolygons, size):
+    rng = random.Random(seed)
+    polygons = []
+    for i in range(numPolygons):
+        poly = Polygon(Vector(rng.uniform(0.0, size), rng.uniform(0.0, size)), rng.uniform(0.0, 2.0 * math.pi))
+        numPoints = rng.randint(3, 10)
+        angle = 2.0 * math.pi / numPoints
+        radius = rng.uniform(5.0, 25.0)
+        for j in range(0, -numPoints, -1):
+            theta = angle * (j + rng.uniform(-0.3, 0.3))
+            poly.addPoint(Vector(radius * math.cos(theta), radius * math.sin(theta)))
+        polygons.append(poly)
+    return polygons
+
+def getCollidingPairs(polygons):
+    pairs = [(i, j) for i in range(len(polygons)) for j in range(i + 1, len(polygons)) if polygons[i].getAABB().overlaps(polygons[j].getAABB())]
+    (isColliding, depths, normals) = sat.BatchSeparatingAxisTest(polygons, pairs).calculate()
+    colliding = np.flatnonzero(isColliding)
+    return (np.array(pairs, dtype=np.intp).reshape(-1, 2)[colliding], depths[colliding], normals[colliding])
+
+def test_batch_matches_single_pair():
+    polygons = makeRandomPolygons(7, 400, 400.0)
+    (pairs, depths, normals) = getCollidingPairs(polygons)
+    assert len(pairs) > 500
+
+    #A small chunk size makes sure the results get put back in pair order across chunks
+    (points, featureIds, separations, offsets, referenceFromA) = sha.BatchSutherlandHodgemanAlgorithm(polygons, pairs, normals, depths, chunkSize=97).calculate()
+    assert len(offsets) == len(pairs) + 1
+
+    for (k, (indexA, indexB)) in enumerate(pairs.tolist()):
+        algorithm = sha.SutherlandHodgemanAlgorithm(polygons[indexA], polygons[indexB], Vector(*normals[k].tolist()), depths[k].item())
+        expected = algorithm.calculate()
+        (start, end) = (offsets[k], offsets[k + 1])
+
+        assert points[start:end].tolist() == [point.asList2() for point in expected]
+        assert [tuple(featureId) for featureId in featureIds[start:end].tolist()] == [point.featureId for point in algorithm.manifold.points]
+        assert separations[start:end].tolist() == [point.separation for point in algorithm.manifold.points]
+        assert bool(referenceFromA[k]) == (algorithm.manifold.referenceFrom == 'A')
+
+def test_batch_with_no_pairs():
+    polygons = makeRandomPolygons(1, 3, 100.0)
+    (points, featureIds, separations, offsets, referenceFromA) = sha.BatchSutherlandHodgemanAlgorithm(polygons, np.empty((0, 2)), np.empty((0, 2)), []).calculate()
+    assert points.shape == (0, 2) and featureIds.shape == (0, 3) and len(separations) == 0
+    assert offsets.tolist() == [0] and len(referenceFromA) == 0
+
+def makeBox(halfWidth, halfHeight, origin, rotation=0.0):
+    return Polygon.fromArray([[-halfWidth, -halfHeight], [-halfWidth, halfHeight], [halfWidth, halfHeight], [halfWidth, -halfHeight]], origin, rotation)
+
+def test_resting_box_keeps_feature_ids():
+    ground = makeBox(10.0, 1.0, Vector(0.0, 0.0))
+    box = makeBox(1.0, 1.0, Vector(0.0, 1.95))
+    cache = sha.ManifoldCache()
+
+    featureIds = None
+    for frame in range(10):
+        #A box sliding and wobbling a little on the ground keeps touching with the same corners
+        box.origin = Vector(0.01 * frame, 1.95 - 0.001 * (frame % 3))
+        box.rotation = 0.002 * (frame % 2)
+        (isColliding, depth, normal) = sat.SeparatingAxisTest(box, ground).calculate()
+        assert isColliding
+
+        algorithm = sha.SutherlandHodgemanAlgorithm(box, ground, normal, depth, cache)
+        algorithm.calculate()
+        manifold = algorithm.manifold
+        assert sum(1 for point in manifold.points if point.separation < 0.0) == 2
+
+        if featureIds is None:
+            featureIds = [point.featureId for point in manifold.points]
+            assert not any(point.isPersistent for point in manifold.points)
+        else:
+            assert [point.featureId for point in manifold.points] == featureIds
+            assert all(point.isPersistent for point in manifold.points)
+            #Whatever the solver put in last frame comes back, and gets added to for this one
+            assert [point.normalImpulse for point in manifold.points] == [frame - 1.0 + 0.5 * i for i in range(len(featureIds))]
+            assert [point.tangentImpulse for point in manifold.points] == [-0.25 * (frame - 1)] * len(featureIds)
+
+        for (i, point) in enumerate(manifold.points):
+            point.normalImpulse = frame + 0.5 * i
+            point.tangentImpulse = -0.25 * frame
+
+def makeManifold(featureIds, referenceFrom='A'):
+    return sha.ContactManifold(Vector(0.0, 1.0), referenceFrom, [sha.ContactPoint(Vector(0.0, 0.0), featureId, -0.1) for featureId in featureIds])
+
+def test_manifold_cache_update():
+    (polyA, polyB) = (makeBox(1.0, 1.0, Vector(0.0, 0.0)), makeBox(1.0, 1.0, Vector(0.0, 1.9)))
+    cache = sha.ManifoldCache()
+
+    old = cache.update(polyA, polyB, makeManifold([(0, 1, -1), (0, 2, 1)]))
+    (old.points[0].normalImpulse, old.points[0].tangentImpulse) = (3.0, 0.5)
+    (old.points[1].normalImpulse, old.points[1].tangentImpulse) = (2.0, -0.5)
+
+    #Only the point whose id matches an old one picks up its impulses, the new one starts from nothing
+    new = cache.update(polyA, polyB, makeManifold([(0, 2, 1), (0, 3, 0)]))
+    assert cache.get(polyA, polyB) is new
+    assert [(point.normalImpulse, point.tangentImpulse, point.isPersistent) for point in new.points] == [(2.0, -0.5, True), (0.0, 0.0, False)]
+
+    #The ids mean something else once the reference edge is on the other polygon, so nothing is carried
+    flipped = cache.update(polyA, polyB, makeManifold([(0, 2, 1)], 'B'))
+    assert (flipped.points[0].normalImpulse, flipped.points[0].isPersistent) == (0.0, False)
+
+    #A pair that was evicted starts over
+    cache.evict(polyA, polyB)
+    assert cache.get(polyA, polyB) is None
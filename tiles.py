@@ -0,0 +1,228 @@
+from utils.utilbase import *
+from parallel import attachSharedMemory, getBufferViews, getWorkerPolygons
+import sat
+import epa
+import sha
+import math
+import os
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+def getTileRanges(mins, maxs, tileSize):
+    """Returns the (minX, minY, maxX, maxY) range of tiles each bounding box touches, as an (n, 4) int64 array"""
+    return np.floor(np.concatenate((mins, maxs), axis=1) / tileSize).astype(np.int64)
+
+def getTileCandidatePairs(tileKey, members, bounds, tileSize):
+    """Sweeps the members of one tile along x and returns the (indexA, indexB) pairs whose bounding boxes overlap and
+    that this tile owns. A pair that straddles a tile border is in every tile both of them touch, so it is only owned by
+    the tile holding the min corner of the overlap of their bounding boxes. That corner is inside both boxes, so the owner
+    is always one of the tiles they share, and every tile works it out the same way without talking to the others"""
+    order = sorted(members, key=lambda index: (bounds[index][0], index))
+    pairs = []
+
+    for (a, indexA) in enumerate(order):
+        (minXA, minYA, maxXA, maxYA) = bounds[indexA]
+        for indexB in order[a + 1:]:
+            (minXB, minYB, maxXB, maxYB) = bounds[indexB]
+            if minXB > maxXA:
+                break
+            if minYB > maxYA or maxYB < minYA:
+                continue
+
+            owner = (math.floor(max(minXA, minXB) / tileSize), math.floor(max(minYA, minYB) / tileSize))
+            if owner == tileKey:
+                pairs.append((min(indexA, indexB), max(indexA, indexB)))
+
+    return pairs
+
+def calculateTiles(name, numPolygons, maxPoints, tileSize, narrowPhase, clip, tiles):
+    """Runs in a worker process, does the broad phase, narrow phase and clipping for a batch of (tileKey, members) tiles.
+    Returns (indexA, indexB, depth, normal, contactPoints) for every colliding pair the tiles own, as plain floats"""
+    block = attachSharedMemory(name)
+    try:
+        (points, counts) = getBufferViews(block.buf, numPolygons, maxPoints)
+        #The bounds come from the same shared points with the same min and max the tiles were worked out with in the
+        #main process, so the ownership test agrees with which tiles each polygon was put in, right down to the last bit
+        indices = sorted(set(index for (tileKey, members) in tiles for index in members))
+        memberPoints = points[indices]
+        bounds = dict(zip(indices, np.concatenate((memberPoints.min(axis=1), memberPoints.max(axis=1)), axis=1).tolist()))
+        del points, counts, memberPoints
+    finally:
+        block.close()
+
+    pairs = []
+    for (tileKey, members) in tiles:
+        pairs.extend(getTileCandidatePairs(tileKey, members, bounds, tileSize))
+
+    polygons = getWorkerPolygons(name, numPolygons, maxPoints, [index for pair in pairs for index in pair])
+
+    results = []
+    for (indexA, indexB) in pairs:
+        (polyA, polyB) = (polygons[indexA], polygons[indexB])
+        if narrowPhase == 'sat':
+            (isColliding, depth, normal) = sat.SeparatingAxisTest(polyA, polyB).calculate()
+        else:
+            (isColliding, depth, normal) = epa.ExpandingPolytopeAlgorithm(polyA, polyB).calculate()
+
+        if not isColliding:
+            continue
+
+        contactPoints = None
+        if clip:
+            contactPoints = [(point.x, point.y) for point in sha.SutherlandHodgemanAlgorithm(polyA, polyB, normal, depth).calculate()]
+        results.append((indexA, indexB, depth, (normal.x, normal.y), contactPoints))
+
+    return results
+
+class TiledWorld:
+    """ Splits the world into square tiles and runs all of collision detection for each tile in a separate worker process - the broad phase, SAT or EPA, and clipping for the contact points - so a huge world can use every core without ever building a global list of candidate pairs. Each polygon is put in every tile its bounding box touches, the world space points are published once per step into shared memory, and the tiles are handed out to the workers in batches. A pair straddling a tile border is only handled by the one tile that owns it, and the results are merged by polygon index, so the output doesn't depend on how many workers there are or which one finished first. The tile size should be a good few times bigger than a typical polygon, or most polygons will straddle borders and get swept by several tiles. Use it as a context manager, or call close when done, to shut the pool down. """
+    def __init__(self, tileSize, narrowPhase='sat', clip=True, maxWorkers=None, tilesPerWorker=4):
+        if narrowPhase not in ('sat', 'epa'):
+            raise ValueError("narrowPhase must be 'sat' or 'epa', not " + repr(narrowPhase))
+
+        self.tileSize = tileSize
+        self.narrowPhase = narrowPhase
+        self.clip = clip
+        self.maxWorkers = maxWorkers if maxWorkers is not None else os.cpu_count()
+        #Tiles can be very uneven, a few batches per worker lets the quick ones pick up the slack
+        self.tilesPerWorker = tilesPerWorker
+        self.executor = ProcessPoolExecutor(self.maxWorkers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def getTiles(self, mins, maxs):
+        """Returns a dict of tile key to the indices of the polygons in it, in index order, leaving out tiles with fewer than two"""
+        tiles = {}
+        for (index, (minX, minY, maxX, maxY)) in enumerate(getTileRanges(mins, maxs, self.tileSize).tolist()):
+            for i in range(minX, maxX + 1):
+                for j in range(minY, maxY + 1):
+                    tiles.setdefault((i, j), []).append(index)
+
+        return {tileKey: members for (tileKey, members) in tiles.items() if len(members) > 1}
+
+    def step(self, polygons):
+        """Returns a ((polyA, polyB), depth, normal, contactPoints) record for every colliding pair, the same as
+        CollisionPipeline.process. polyA always comes before polyB in polygons, the normal points from B to A the same as
+        it does out of SAT and EPA, and the records are sorted by where the pair is in polygons. contactPoints is None if
+        clipping is off"""
+        polygons = list(polygons)
+        if len(polygons) < 2:
+            return []
+
+        (packedPoints, _, packedCounts) = packPolygons(polygons)
+        (numPolygons, maxPoints) = packedPoints.shape[:2]
+
+        #Padding repeats the last point, so the min and max over the padded rows are the real bounding boxes
+        tiles = self.getTiles(packedPoints.min(axis=1), packedPoints.max(axis=1))
+        if len(tiles) == 0:
+            return []
+
+        block = shared_memory.SharedMemory(create=True, size=packedPoints.nbytes + numPolygons * 8)
+        try:
+            (points, counts) = getBufferViews(block.buf, numPolygons, maxPoints)
+            points[:] = packedPoints
+            counts[:] = packedCounts
+            del points, counts
+
+            #Neighbouring tiles share their straddling polygons, so handing out runs of neighbouring tiles means fewer rebuilds
+            tileList = sorted(tiles.items())
+            numBatches = min(len(tileList), self.maxWorkers * self.tilesPerWorker)
+            batches = [tileList[i * len(tileList) // numBatches:(i + 1) * len(tileList) // numBatches] for i in range(numBatches)]
+            futures = [self.executor.submit(calculateTiles, block.name, numPolygons, maxPoints, self.tileSize, self.narrowPhase, self.clip, batch) for batch in batches]
+
+            #Ownership means no pair should come back twice, but keying on the pair makes sure of it
+            merged = {}
+            for future in futures:
+                for (indexA, indexB, depth, normal, contactPoints) in future.result():
+                    merged.setdefault((indexA, indexB), (depth, normal, contactPoints))
+        finally:
+            block.close()
+            block.unlink()
+
+        results = []
+        for (indexA, indexB) in sorted(merged):
+            (depth, normal, contactPoints) = merged[(indexA, indexB)]
+            if contactPoints is not None:
+                contactPoints = [Vector(x, y) for (x, y) in contactPoints]
+            results.append(((polygons[indexA], polygons[indexB]), depth, Vector(normal[0], normal[1]), contactPoints))
+
+        return results
+
+if __name__ == '__main__':
+    import pygame
+    from utils.rendering import *
+
+    random.seed(1)
+    polygons = []
+    velocities = []
+
+    for k in range(300):
+        poly = Polygon(Vector(random.uniform(20, 780), random.uniform(20, 580)), random.uniform(0, 2.0 * math.pi))
+        numPoints = random.randint(3, 8)
+        angle = 2.0 * math.pi / numPoints
+        radius = random.uniform(6, 16)
+        for i in range(0, -numPoints, -1):
+            poly.addPoint(Vector(radius * math.cos(angle * i), radius * math.sin(angle * i)))
+
+        polygons.append(poly)
+        velocities.append(Vector(random.uniform(-1, 1), random.uniform(-1, 1)))
+
+    tileSize = 200.0
+    tiledWorld = TiledWorld(tileSize, 'sat', maxWorkers=4)
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    pygame.display.set_caption("Tiled World Demo")
+
+    running = True
+
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        for (poly, velocity) in zip(polygons, velocities):
+            poly.origin += velocity
+            poly.rotation += 0.01
+            if poly.origin.x < 0 or poly.origin.x > 800:
+                velocity.x *= -1.0
+            if poly.origin.y < 0 or poly.origin.y > 600:
+                velocity.y *= -1.0
+
+        results = tiledWorld.step(polygons)
+
+        screen.fill((0, 0, 0))
+        for x in range(0, 800, int(tileSize)):
+            drawLine(screen, Vector(x, 0), Vector(x, 600), color=(60, 60, 60))
+        for y in range(0, 600, int(tileSize)):
+            drawLine(screen, Vector(0, y), Vector(800, y), color=(60, 60, 60))
+
+        for poly in polygons:
+            drawPolygon(screen, poly)
+
+        for ((polyA, polyB), depth, normal, contactPoints) in results:
+            drawPolygon(screen, polyA, color = (255, 0, 0))
+            drawPolygon(screen, polyB, color = (255, 0, 0))
+            for point in contactPoints:
+                drawCircle(screen, point, 2.0, color=(0, 0, 255))
+
+        contactText = font.render("Colliding pairs " + str(len(results)), True, (255, 255, 255))
+        screen.blit(contactText, (600, 560))
+
+        pygame.display.flip()
+        clock.tick(60)
+
+    tiledWorld.close()
+    pygame.quit()
@@ -0,0 +1,81 @@
+import json
+import numpy as np
+from collections import deque
+
+class CollisionMetrics:
+    """ Collects counters and timings from the collision algorithms. Pass one in as the metrics argument of an algorithm and every call to calculate records how long it took along with its counters (support calls, GJK iterations, EPA expansions, SAT axes tested, clip passes and so on). Calls are summed up per frame until endFrame is called, and every call is also kept as a sample so the counters can be exported as histograms. Calls that went wrong in a way worth looking at, like GJK giving up at its iteration cap, are flagged along with a copy of the pair's world space points. Everything it keeps is bounded - only the last maxSamples samples of each counter, the last maxFrames frame totals and the last maxFlagged flagged pairs - so it can be left running in a scene with thousands of pairs a frame. When an algorithm is given no metrics it doesn't time anything or record anything. """
+    def __init__(self, maxSamples=100000, maxFrames=3600, maxFlagged=1000):
+        self.maxSamples = maxSamples
+        self.maxFrames = maxFrames
+        self.maxFlagged = maxFlagged
+        self.reset()
+
+    def record(self, algorithm, seconds, counters):
+        """Records one call, counters is a dict of counter name to value"""
+        totals = self.__currentFrame.get(algorithm)
+        if totals is None:
+            totals = {'calls': 0, 'seconds': 0.0}
+            self.__currentFrame[algorithm] = totals
+
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+
+        samples = self.samples.get(algorithm)
+        if samples is None:
+            samples = {}
+            self.samples[algorithm] = samples
+
+        self.__getSamples(samples, 'seconds').append(seconds)
+        for (name, value) in counters.items():
+            totals[name] = totals.get(name, 0) + value
+            self.__getSamples(samples, name).append(value)
+
+    def __getSamples(self, samples, name):
+        #Once a buffer is full the oldest samples drop off the front, so the histograms cover the most recent calls
+        buffer = samples.get(name)
+        if buffer is None:
+            buffer = deque(maxlen=self.maxSamples)
+            samples[name] = buffer
+        return buffer
+
+    def flag(self, algorithm, reason, polyA, polyB):
+        """Remembers a pathological pair. Copies of the world space points are kept rather than the polygons themselves,
+        so nothing is kept alive and the pair can be rebuilt later with Polygon.fromArray exactly as it was"""
+        self.flagged.append((self.numFrames, algorithm, reason, polyA.getTransformedArray().copy(), polyB.getTransformedArray().copy()))
+
+    def getCurrentFrame(self):
+        return self.__currentFrame
+
+    def endFrame(self):
+        """Finishes the current frame and returns its totals, a dict of algorithm to its summed counters"""
+        frame = self.__currentFrame
+        self.frames.append(frame)
+        self.numFrames += 1
+        self.__currentFrame = {}
+        return frame
+
+    def reset(self):
+        self.frames = deque(maxlen=self.maxFrames)
+        self.flagged = deque(maxlen=self.maxFlagged)
+        self.samples = {}
+        self.numFrames = 0
+        self.__currentFrame = {}
+
+    def getHistogram(self, algorithm, counter, bins=10):
+        """Returns (counts, binEdges) of the per call values of a counter, the same as numpy.histogram"""
+        values = self.samples.get(algorithm, {}).get(counter, [])
+        return np.histogram(np.fromiter(values, dtype=np.float64, count=len(values)), bins=bins)
+
+    def exportHistograms(self, outputFile, bins=10):
+        """Writes a histogram of every counter of every algorithm to a file as json"""
+        histograms = {}
+        for (algorithm, counters) in self.samples.items():
+            histograms[algorithm] = {}
+            for counter in counters:
+                (counts, binEdges) = self.getHistogram(algorithm, counter, bins)
+                histograms[algorithm][counter] = {'counts': counts.tolist(), 'binEdges': binEdges.tolist()}
+
+        flagged = [{'frame': frame, 'algorithm': algorithm, 'reason': reason, 'pointsA': pointsA.tolist(), 'pointsB': pointsB.tolist()}
+            for (frame, algorithm, reason, pointsA, pointsB) in self.flagged]
+        json.dump({'histograms': histograms, 'frames': self.numFrames, 'flagged': flagged}, outputFile, indent=2)
+        outputFile.write('\n')
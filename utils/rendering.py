@@ -0,0 +1,12 @@
+import pygame
+
+def drawPolygon(screen, poly, color=(255, 255, 255)):
+    (points, centroid_ws) = poly.getTransformedPoints()
+    pygame.draw.polygon(screen, color, [point.asList2() for point in points], 3)
+    drawCircle(screen, centroid_ws, 3)
+
+def drawLine(screen, start, end, color=(0, 255, 0)):
+    pygame.draw.line(screen, color, start.asList2(), end.asList2(), 2)
+
+def drawCircle(screen, origin, radius, color=(255, 255, 0)):
+    pygame.draw.circle(screen, color, origin.asList2(), radius, 0)
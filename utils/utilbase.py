@@ -1,8 +1,11 @@
+import bisect
 import math
-import pygame
-import functools
+import numpy as np
 
 class Vector:
+    #No __dict__, so each vector is just the two floats
+    __slots__ = ('x', 'y')
+
     def __init__(self, x = 0.0, y = 0.0):
         self.x = x
         self.y = y
@@ -18,8 +21,13 @@ class Vector:
         return Vector(self.x / scalar, self.y / scalar)
     def __str__(self):
         return "X: " + str(round(self.x, 3)) + " Y: " + str(round(self.y, 3))
+    def __neg__(self):
+        return Vector(-self.x, -self.y)
     def dot(self, other):
         return self.x * other.x + self.y * other.y
+    def dotNegated(self, other):
+        """Same as self.dot(other * -1.0) without making the negated vector"""
+        return -(self.x * other.x + self.y * other.y)
     def getMagnitudeSquared(self):
         return (self.x * self.x + self.y * self.y)
     def getMagnitude(self):
@@ -43,11 +51,37 @@ def rotateAround(inputVector, angle_rad, around=Vector(0.0, 0.0)):
         return temp
 
     temp = temp - around
+    cos_a = math.cos(angle_rad)
+    sin_a = math.sin(angle_rad)
+
+    return Vector(temp.x * cos_a - temp.y * sin_a, temp.x * sin_a + temp.y * cos_a) + around
 
-    temp.x = inputVector.x * math.cos(angle_rad) - inputVector.y * math.sin(angle_rad)
-    temp.y = inputVector.x * math.sin(angle_rad) + inputVector.y * math.cos(angle_rad)
+def getRotationMatrix(angle_rad):
+    """Returns the transpose of the 2x2 rotation matrix, so row vectors can be rotated with points @ matrix"""
+    cos_a = math.cos(angle_rad)
+    sin_a = math.sin(angle_rad)
+    return np.array([[cos_a, sin_a], [-sin_a, cos_a]])
+
+def isStrictlyConvex(points):
+    """True if every corner of the (n, 2) point array turns the same way, with no collinear or repeated points"""
+    if len(points) < 3:
+        return False
+    edges = np.roll(points, -1, axis=0) - points
+    nextEdges = np.roll(edges, -1, axis=0)
+    crosses = edges[:, 0] * nextEdges[:, 1] - edges[:, 1] * nextEdges[:, 0]
+    tolerance = 1e-9 * np.einsum('ij,ij->i', edges, edges).max()
+    return bool((crosses > tolerance).all() or (crosses < -tolerance).all())
 
-    return temp + around
+def getUniqueAxisIndices(normals):
+    """Returns the indices of the normals that aren't parallel to an earlier one. Opposite normals give the same
+    projection intervals, so the separating axis test only needs one of each"""
+    #The angle of each normal folded into [0, pi), so parallel and opposite normals end up with the same angle
+    angles = np.round(np.mod(np.arctan2(normals[:, 1], normals[:, 0]), math.pi), 9)
+    (keys, firstIndices) = np.unique(angles, return_index=True)
+    return np.sort(firstIndices)
+
+def toVectorList(points):
+    return [Vector(x, y) for (x, y) in points.tolist()]
 
 class Edge:
     def __init__(self, startIndex, endIndex):
@@ -77,48 +111,574 @@ class EdgeList:
         edge2 = Edge((edge.startIndex - 1) % numPoints, edge.startIndex)
         return [edge1, edge2]
 
+class AABB:
+    """Axis aligned bounding box, stored as its min and max corners"""
+    def __init__(self, minX, minY, maxX, maxY):
+        self.minX = minX
+        self.minY = minY
+        self.maxX = maxX
+        self.maxY = maxY
+    def overlaps(self, other):
+        return self.minX <= other.maxX and other.minX <= self.maxX and self.minY <= other.maxY and other.minY <= self.maxY
+    def contains(self, other):
+        return self.minX <= other.minX and self.minY <= other.minY and other.maxX <= self.maxX and other.maxY <= self.maxY
+    def containsPoint(self, point):
+        return self.minX <= point.x <= self.maxX and self.minY <= point.y <= self.maxY
+    def rayCast(self, start, delta, maxFraction=1.0):
+        """Slab test of the ray start + t * delta against the box for t between 0 and maxFraction. Returns the t where
+        the ray enters the box (0 if it starts inside), or None if it misses"""
+        #Written out for each axis rather than looped, this gets called for every tree node a ray passes near
+        tMin = 0.0
+        tMax = maxFraction
+
+        if delta.x == 0.0:
+            if start.x < self.minX or start.x > self.maxX:
+                return None
+        else:
+            t1 = (self.minX - start.x) / delta.x
+            t2 = (self.maxX - start.x) / delta.x
+            if t1 > t2:
+                (t1, t2) = (t2, t1)
+            if t1 > tMin:
+                tMin = t1
+            if t2 < tMax:
+                tMax = t2
+            if tMin > tMax:
+                return None
+
+        if delta.y == 0.0:
+            if start.y < self.minY or start.y > self.maxY:
+                return None
+        else:
+            t1 = (self.minY - start.y) / delta.y
+            t2 = (self.maxY - start.y) / delta.y
+            if t1 > t2:
+                (t1, t2) = (t2, t1)
+            if t1 > tMin:
+                tMin = t1
+            if t2 < tMax:
+                tMax = t2
+            if tMin > tMax:
+                return None
+
+        return tMin
+    def union(self, other):
+        return AABB(min(self.minX, other.minX), min(self.minY, other.minY), max(self.maxX, other.maxX), max(self.maxY, other.maxY))
+    def getFattened(self, margin):
+        return AABB(self.minX - margin, self.minY - margin, self.maxX + margin, self.maxY + margin)
+    def getPerimeter(self):
+        return 2.0 * ((self.maxX - self.minX) + (self.maxY - self.minY))
+    def __str__(self):
+        return "Min: " + str(round(self.minX, 3)) + ", " + str(round(self.minY, 3)) + " Max: " + str(round(self.maxX, 3)) + ", " + str(round(self.maxY, 3))
+
+class ConvexShape:
+    """ The geometry of a polygon in its own local space - its points, unit edge normals, edge lengths, centroid, bounding radius, and which edge normals are worth testing in SAT. Everything is worked out once when the shape is made and never changes after that, so any number of polygons can share the same shape and each one only has to carry its own origin and rotation. Build one with ConvexShape(points) from an (n, 2) array or a list of [x, y] pairs, then make polygons from it with Polygon.fromShape. """
+    def __init__(self, points):
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        numPoints = len(points)
+        centroidArray = points.mean(axis=0) if numPoints > 0 else np.zeros(2)
+
+        #The unit edge normals are only normalized here, in local space. Rotating them keeps them unit length,
+        #so the world space ones come from the same rotation as the points with no square roots
+        directions = points - np.roll(points, -1, axis=0)
+        edgeLengths = np.sqrt(np.einsum('ij,ij->i', directions, directions))
+        edgeNormals = np.column_stack((directions[:, 1], -directions[:, 0])) / edgeLengths[:, None]
+
+        axisIndices = getUniqueAxisIndices(edgeNormals) if numPoints > 0 else np.empty(0, dtype=np.intp)
+        centered = points - centroidArray
+        boundingRadius = math.sqrt(np.einsum('ij,ij->i', centered, centered).max()) if numPoints > 0 else 0.0
+
+        self.__setParts(points, centroidArray, edgeNormals, edgeLengths, isStrictlyConvex(points), axisIndices, boundingRadius)
+
+    @classmethod
+    def fromParts(cls, points, centroidArray, edgeNormals, edgeLengths, isStrictlyConvex, axisIndices, boundingRadius):
+        """Makes a shape out of data that's already been worked out, like buildConvexShapes does for many shapes at once.
+        The arrays aren't copied, they're just made read only"""
+        shape = cls.__new__(cls)
+        shape.__setParts(points, centroidArray, edgeNormals, edgeLengths, isStrictlyConvex, axisIndices, boundingRadius)
+        return shape
+
+    def __setParts(self, points, centroidArray, edgeNormals, edgeLengths, isStrictlyConvex, axisIndices, boundingRadius):
+        for array in (points, centroidArray, edgeNormals, edgeLengths, axisIndices):
+            array.setflags(write=False)
+
+        self.points = points
+        self.centroidArray = centroidArray
+        self.centroid = Vector(*centroidArray.tolist())
+        self.edgeNormals = edgeNormals
+        self.edgeLengths = edgeLengths
+        self.isStrictlyConvex = isStrictlyConvex
+        self.axisIndices = axisIndices
+        self.boundingRadius = boundingRadius
+
+        #+1 if the edge normals point out of the shape and -1 if they point in, which depends on which way round the points go
+        self.normalSign = 1.0
+        if len(points) > 0 and (edgeNormals[0] @ (points[0] - centroidArray)) < 0:
+            self.normalSign = -1.0
+
+        self.__pointVectors = None
+        self.__edgeList = None
+        self.__supportTable = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def getSupportTable(self):
+        """Returns (angles, vertices) for finding support points by binary search on a strictly convex shape. angles is
+        the angle of every outward edge normal in local space, sorted and between 0 and 2 pi, and vertices[k] is the point
+        between the edges at angles[k - 1] and angles[k], which is the furthest point along any direction between them.
+        Built the first time it's asked for"""
+        if self.__supportTable is None:
+            numPoints = len(self.points)
+            outward = self.edgeNormals * self.normalSign
+            angles = np.mod(np.arctan2(outward[:, 1], outward[:, 0]), 2.0 * math.pi)
+            order = np.argsort(angles, kind='stable')
+            previous = np.roll(order, 1)
+
+            #Going round the sorted normals steps from edge to edge round the shape, one way or the other. If the
+            #next edge comes after the previous one they share its start point, otherwise they share the previous one's
+            vertices = np.where(order == (previous + 1) % numPoints, order, previous)
+            self.__supportTable = (angles[order].tolist(), vertices.tolist())
+        return self.__supportTable
+
+    def getPointVectors(self):
+        """The local points as a list of Vectors, built the first time they're asked for. Treat it as read only"""
+        if self.__pointVectors is None:
+            self.__pointVectors = toVectorList(self.points)
+        return self.__pointVectors
+
+    def getEdgeList(self):
+        """The edges as an EdgeList, edge i runs from point i to point i + 1. Built the first time it's asked for"""
+        if self.__edgeList is None:
+            numPoints = len(self.points)
+            self.__edgeList = EdgeList([Edge(i, (i + 1) % numPoints) for i in range(numPoints)])
+        return self.__edgeList
+
+def buildConvexShapes(vertices, offsets):
+    """Builds many shapes at once from one flat (numVertices, 2) block of points, where shape i is made of the points
+    offsets[i] to offsets[i + 1]. Everything ConvexShape works out point by point is done here for every shape in one go,
+    so the only per shape work left in Python is slicing out its part of the results. The block isn't copied if it's
+    already float64, the shapes' points are views straight into it - so a block mapped from a file stays in the map and is
+    only paged in as it's used. Don't change the block after the shapes are built."""
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(offsets)
+    numShapes = len(counts)
+    numVertices = len(vertices)
+
+    #Which shape each point belongs to, and the index of the next point around the same shape
+    shapeIds = np.repeat(np.arange(numShapes), counts)
+    indices = np.arange(numVertices)
+    nextIndices = indices + 1
+    nonEmpty = np.flatnonzero(counts > 0)
+    starts = offsets[nonEmpty]
+    nextIndices[offsets[nonEmpty + 1] - 1] = starts
+
+    directions = vertices - vertices[nextIndices]
+    edgeLengthsSquared = np.einsum('ij,ij->i', directions, directions)
+    edgeLengths = np.sqrt(edgeLengthsSquared)
+    edgeNormals = np.column_stack((directions[:, 1], -directions[:, 0])) / edgeLengths[:, None]
+
+    #reduceat only gets the start of each non empty shape, since an empty one would take the first point of the next
+    centroids = np.zeros((numShapes, 2))
+    boundingRadii = np.zeros(numShapes)
+    isConvex = np.zeros(numShapes, dtype=bool)
+    if len(nonEmpty) > 0:
+        centroids[nonEmpty] = np.add.reduceat(vertices, starts) / counts[nonEmpty, None]
+
+        centered = vertices - centroids[shapeIds]
+        boundingRadii[nonEmpty] = np.sqrt(np.maximum.reduceat(np.einsum('ij,ij->i', centered, centered), starts))
+
+        #Same test as isStrictlyConvex, every corner has to turn the same way by more than the tolerance
+        nextDirections = directions[nextIndices]
+        crosses = directions[:, 0] * nextDirections[:, 1] - directions[:, 1] * nextDirections[:, 0]
+        tolerances = (1e-9 * np.maximum.reduceat(edgeLengthsSquared, starts))[np.repeat(np.arange(len(nonEmpty)), counts[nonEmpty])]
+        turnsLeft = np.logical_and.reduceat(crosses > tolerances, starts)
+        turnsRight = np.logical_and.reduceat(crosses < -tolerances, starts)
+        isConvex[nonEmpty] = (turnsLeft | turnsRight) & (counts[nonEmpty] >= 3)
+
+    #Same as getUniqueAxisIndices on each shape. Sorting by shape, then angle, then index puts the first normal
+    #with each angle in each shape at the start of its run
+    angles = np.round(np.mod(np.arctan2(edgeNormals[:, 1], edgeNormals[:, 0]), math.pi), 9)
+    order = np.lexsort((indices, angles, shapeIds))
+    isFirst = np.ones(numVertices, dtype=bool)
+    isFirst[1:] = (shapeIds[order][1:] != shapeIds[order][:-1]) | (angles[order][1:] != angles[order][:-1])
+    axisIndices = np.sort(order[isFirst])
+    axisBounds = np.searchsorted(axisIndices, offsets)
+    localAxisIndices = axisIndices - offsets[shapeIds[axisIndices]]
+
+    shapes = []
+    for i in range(numShapes):
+        (start, end) = (offsets[i], offsets[i + 1])
+        shapes.append(ConvexShape.fromParts(vertices[start:end], centroids[i], edgeNormals[start:end], edgeLengths[start:end],
+            bool(isConvex[i]), localAxisIndices[axisBounds[i]:axisBounds[i + 1]], float(boundingRadii[i])))
+
+    return shapes
+
+#Every polygon starts out with this until it's given points
+emptyShape = ConvexShape(np.empty((0, 2)))
+
 class Polygon:
+    #The binary search can land one vertex off when a direction is right on an edge normal, the climb only has to fix that
+    SUPPORT_CLIMB_LIMIT = 8
+
     def __init__(self, origin=Vector(0, 0), rotation=0.0):
-        self.points = []
-        self.origin = origin
-        self.rotation = rotation
-        self.centroid_local = Vector(0.0, 0.0)
+        #The local geometry lives in a ConvexShape, which can be shared with other polygons. Points added one at a
+        #time are collected in a plain list, and only turned into a shape the first time it's needed
+        self.__shape = emptyShape
+        self.__pendingPoints = None
+        self.__origin = origin
+        self.__rotation = rotation
+
+        #World space data is cached and only rebuilt when the origin, rotation or points change. It's only made
+        #the first time it's needed, so a polygon that's never tested stays small
+        #Note that mutating the origin vector in place (e.g. origin.x += 1) will not be picked up,
+        #assign a new vector instead, which is what += on the attribute does anyway
+        self.__transformDirty = True
+        self.__worldPoints = None
+        self.__worldCentroid = None
+        self.__worldEdgeNormals = None
+        self.__worldAxes = None
+        self.__worldAABB = None
+        self.__worldPointList = None
+        self.__worldPointVectors = None
+        self.__worldEdgeNormalVectors = None
+
+        #How many support point searches had to fall back to checking every vertex
+        self.numSupportFallbacks = 0
+
+    @property
+    def origin(self):
+        return self.__origin
+
+    @origin.setter
+    def origin(self, value):
+        self.__origin = value
+        self.__transformDirty = True
+
+    @property
+    def rotation(self):
+        return self.__rotation
+
+    @rotation.setter
+    def rotation(self, value):
+        self.__rotation = value
+        self.__transformDirty = True
+
+    @property
+    def shape(self):
+        """The ConvexShape holding this polygon's local geometry, which may be shared with other polygons"""
+        if self.__pendingPoints is not None:
+            self.__shape = ConvexShape(self.__pendingPoints)
+            self.__pendingPoints = None
+        return self.__shape
+
+    @shape.setter
+    def shape(self, value):
+        self.__shape = value
+        self.__pendingPoints = None
+        self.__transformDirty = True
+
+    @property
+    def points(self):
+        """The local space points as Vectors, treat this as read only and use addPoint or assign a new list instead"""
+        return self.shape.getPointVectors()
+
+    @points.setter
+    def points(self, value):
+        self.shape = ConvexShape([point.asList2() for point in value])
+
+    @property
+    def centroid_local(self):
+        return self.shape.centroid
+
+    @classmethod
+    def fromArray(cls, points, origin=Vector(0, 0), rotation=0.0):
+        """Builds a polygon from an (n, 2) array of local points in one go, the array is copied"""
+        return cls.fromShape(ConvexShape(points), origin, rotation)
+
+    @classmethod
+    def fromShape(cls, shape, origin=Vector(0, 0), rotation=0.0):
+        """Makes a polygon that shares an existing shape, which is the cheap way to spawn lots of identical bodies"""
+        poly = cls(origin, rotation)
+        poly.shape = shape
+        return poly
+
     def addPoint(self, point):
-        """Add a point to the polygon list, its up to you to ensure its counterclockwise"""
-        self.points.append(point)
-        self.__calculateCentroid()
+        """Add a point to the polygon list, its up to you to ensure its counterclockwise. If the shape is shared,
+        this polygon gets its own copy and the others are left alone"""
+        if self.__pendingPoints is None:
+            self.__pendingPoints = self.__shape.points.tolist()
+        self.__pendingPoints.append([point.x, point.y])
+        self.__transformDirty = True
+    def invalidate(self):
+        """Forces the world space cache to be rebuilt, only needed if you've mutated the origin in place"""
+        self.__transformDirty = True
     def getEdgeList(self):
-        """Gets a normalized list of the edges in the polygon, note that this is clockwise"""
-        i = 0
-        numPoints = len(self.points)
-        edges = []
-        while i < numPoints + 1:
-            edge1Index = i % numPoints
-            edge2Index = (i + 1) % numPoints
-            edges.append(Edge(edge1Index, edge2Index))
-            i += 1
-        
-        return EdgeList(edges)
+        """Gets the list of the edges in the polygon, note that this is clockwise. Edge i runs from point i to point i + 1,
+        it's shared with the shape so treat it as read only"""
+        return self.shape.getEdgeList()
     def getFurthestPoint(self, normal):
-        return max(self.getTransformedPoints()[0], key=lambda pt: pt.dot(normal))
+        index = self.getSupportIndex(normal.x, normal.y)
+        (x, y) = self.__worldPointList[index]
+        return Vector(x, y)
+
+    def getFurthestCoordinates(self, directionX, directionY):
+        """Same as getFurthestPoint, but returns the cached [x, y] list of the point so nothing new gets made. Don't change it"""
+        #The index has to come first, getting it is what rebuilds the list if the transform is dirty
+        index = self.getSupportIndex(directionX, directionY)
+        return self.__worldPointList[index]
 
-    def __calculateCentroid(self):
-        total = functools.reduce(lambda a,b: a+b, self.points)
-        self.centroid_local = total / len(self.points)
+    def getSupportIndex(self, directionX, directionY):
+        """Returns the index of the world space point furthest along the direction. On a strictly convex polygon the
+        outward edge normals go round in order, and the furthest point along a direction is the one between the two
+        normals either side of it. So we turn the direction into an angle in local space and binary search the shape's
+        sorted normal angles, which takes log n steps no matter how far the direction has swung since the last call.
+        Rounding can leave that one vertex off when the direction is right on a normal, so we then climb to whichever
+        neighbour is further. Polygons with collinear points, which can have false peaks, get a full argmax."""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        points = self.__worldPointList
+        numPoints = len(points)
+
+        if self.__shape.isStrictlyConvex and numPoints > 3:
+            (angles, vertices) = self.__shape.getSupportTable()
+            angle = (math.atan2(directionY, directionX) - self.__rotation) % (2.0 * math.pi)
+            index = vertices[bisect.bisect_left(angles, angle) % numPoints]
+
+            (x, y) = points[index]
+            best = x * directionX + y * directionY
+
+            (x, y) = points[(index + 1) % numPoints]
+            nextDot = x * directionX + y * directionY
+            (x, y) = points[index - 1]
+            prevDot = x * directionX + y * directionY
+
+            if nextDot > best:
+                step = 1
+            elif prevDot > best:
+                step = -1
+            else:
+                return self.__getFirstTiedIndex(index, best, directionX, directionY)
+
+            for i in range(self.SUPPORT_CLIMB_LIMIT):
+                (x, y) = points[(index + step) % numPoints]
+                dot = x * directionX + y * directionY
+                if dot <= best:
+                    return self.__getFirstTiedIndex(index, best, directionX, directionY)
+                index = (index + step) % numPoints
+                best = dot
+
+            self.numSupportFallbacks += 1
+
+        #Written out per coordinate rather than with a matrix product, so the dots are the same floats the climb compares
+        points = self.__worldPoints
+        return int(np.argmax(points[:, 0] * directionX + points[:, 1] * directionY))
+
+    def __getFirstTiedIndex(self, index, best, directionX, directionY):
+        """An edge at right angles to the direction has two points equally far along it. GJK's first simplex depends on
+        which one comes back, so the climb has to give the lower index, the same one a full argmax would"""
+        points = self.__worldPointList
+        numPoints = len(points)
+        for neighbour in ((index - 1) % numPoints, (index + 1) % numPoints):
+            (x, y) = points[neighbour]
+            if neighbour < index and x * directionX + y * directionY == best:
+                return neighbour
+        return index
 
     def getCentroidWorldSpace(self):
         return self.centroid_local + self.origin
 
+    def containsPoint(self, point):
+        """True if the world space point is inside the polygon or on its boundary"""
+        if not self.getAABB().containsPoint(point):
+            return False
+
+        #The point has to be on the inside of every edge
+        points = self.getTransformedArray()
+        normals = self.getEdgeNormalArray()
+        distances = (normals @ (point.x, point.y) - np.einsum('ij,ij->i', normals, points)) * self.shape.normalSign
+        return bool((distances <= 0.0).all())
+
+    def overlapsAABB(self, aabb):
+        """True if the polygon overlaps the world space box or touches it. The box's own axes are the bounding box test,
+        so the only other axes that could separate them are the polygon's edge normals"""
+        if not self.getAABB().overlaps(aabb):
+            return False
+
+        axes = self.getSeparatingAxes()
+        projections = self.getTransformedArray() @ axes.T
+        centers = axes @ ((aabb.minX + aabb.maxX) * 0.5, (aabb.minY + aabb.maxY) * 0.5)
+        radii = np.abs(axes) @ ((aabb.maxX - aabb.minX) * 0.5, (aabb.maxY - aabb.minY) * 0.5)
+        return bool(((projections.min(axis=0) <= centers + radii) & (centers - radii <= projections.max(axis=0))).all())
+
+    def rayCast(self, start, end, maxFraction=1.0):
+        """ Casts the ray from start towards end against the polygon, and returns (fraction, normal) for where it first hits, where the hit point is start + (end - start) * fraction and the normal is the outward unit normal of the edge it hits. Returns None if it misses, if the hit is further than maxFraction, or if the ray starts inside the polygon. Each edge is a plane the ray crosses at some fraction - going in if it's heading against the edge's outward normal, coming out if it's heading along it. The ray is inside the polygon after the last plane it goes in through and before the first one it comes out through, so it hits if those are the right way round. """
+        points = self.getTransformedArray()
+        normals = self.getEdgeNormalArray()
+        sign = self.shape.normalSign
+        (deltaX, deltaY) = (end.x - start.x, end.y - start.y)
+
+        #How far each edge is in front of the start along its outward normal, and how fast the ray closes on it
+        numerators = (np.einsum('ij,ij->i', normals, points) - normals @ (start.x, start.y)) * sign
+        denominators = (normals @ (deltaX, deltaY)) * sign
+
+        #A ray running parallel to an edge misses if it's on the outside of it
+        if (numerators[denominators == 0.0] < 0.0).any():
+            return None
+
+        entering = np.flatnonzero(denominators < 0.0)
+        exiting = np.flatnonzero(denominators > 0.0)
+
+        lower = 0.0
+        lowerIndex = -1
+        if len(entering) > 0:
+            fractions = numerators[entering] / denominators[entering]
+            best = int(np.argmax(fractions))
+            if fractions[best] > lower:
+                lower = fractions[best].item()
+                lowerIndex = int(entering[best])
+
+        upper = maxFraction
+        if len(exiting) > 0:
+            upper = min(upper, (numerators[exiting] / denominators[exiting]).min().item())
+
+        #No plane was entered after the start means the ray started inside
+        if lowerIndex < 0 or lower > upper:
+            return None
+
+        (normalX, normalY) = (normals[lowerIndex] * sign).tolist()
+        return (lower, Vector(normalX, normalY))
+
+    def __updateTransform(self):
+        shape = self.shape
+
+        #A single matrix multiply rotates every point about the centroid, then we translate to the origin
+        #The edge normals just need the same rotation
+        rotation = getRotationMatrix(self.__rotation)
+        self.__worldPoints = (shape.points - shape.centroidArray) @ rotation + (self.__origin.x, self.__origin.y)
+        self.__worldCentroid = Vector(*self.__worldPoints.mean(axis=0).tolist())
+        self.__worldEdgeNormals = shape.edgeNormals @ rotation
+        self.__worldAxes = self.__worldEdgeNormals[shape.axisIndices]
+        (minX, minY) = self.__worldPoints.min(axis=0).tolist()
+        (maxX, maxY) = self.__worldPoints.max(axis=0).tolist()
+        self.__worldAABB = AABB(minX, minY, maxX, maxY)
+        self.__worldPointList = self.__worldPoints.tolist()
+        self.__worldPointVectors = None
+        self.__worldEdgeNormalVectors = None
+
+        self.__transformDirty = False
+
+    def getTransformedArray(self):
+        """Returns the world space points as a cached (n, 2) array, treat it as read only"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        return self.__worldPoints
+
+    def getEdgeNormalArray(self):
+        """Returns the unit world space normal of each edge as a cached (n, 2) array, edge i runs from point i to point i + 1"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        return self.__worldEdgeNormals
+
+    def getEdgeLengths(self):
+        """Returns the length of each edge as an array, in the same order as the edge normals"""
+        return self.shape.edgeLengths
+
+    def getBoundingRadius(self):
+        """Distance from the centroid to the furthest point, which is what the polygon rotates around"""
+        return self.shape.boundingRadius
+
+    def getSeparatingAxes(self):
+        """Returns the world space edge normals with parallel duplicates removed, as a cached (n, 2) array"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        return self.__worldAxes
+
+    def getAABB(self):
+        """Returns the cached world space bounding box of the transformed points"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        return self.__worldAABB
+
     def getTransformedPoints(self):
-        points_base = [(point - self.centroid_local) for point in self.points]
-        rot_points = [rotateAround(point, self.rotation, Vector(0.0, 0.0)) for point in points_base]
-        points = [(point + self.origin) for point in rot_points]
+        """Returns the world space points and centroid. These are cached, so treat them as read only"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        if self.__worldPointVectors is None:
+            self.__worldPointVectors = toVectorList(self.__worldPoints)
+
+        return (self.__worldPointVectors, self.__worldCentroid)
+
+    def getEdgeNormals(self):
+        """Returns the unit world space normal of each edge, in the same order as the points"""
+        if self.__transformDirty:
+            self.__updateTransform()
+
+        if self.__worldEdgeNormalVectors is None:
+            self.__worldEdgeNormalVectors = toVectorList(self.__worldEdgeNormals)
 
-        return (points, functools.reduce(lambda a,b: a+b, points) / len(points))
+        return self.__worldEdgeNormalVectors
     
+def packPolygons(polygons):
+    """Packs the world space points and edge normals of a list of polygons into padded (numPolygons, maxPoints, 2) arrays.
+    Shorter polygons are padded by repeating their last point and normal, which doesn't change any projection interval,
+    so the padded rows can be used as is. Also returns the real point count of each polygon."""
+    counts = np.array([len(poly.getTransformedArray()) for poly in polygons], dtype=np.intp)
+    maxCount = int(counts.max()) if len(polygons) > 0 else 0
+    points = np.empty((len(polygons), maxCount, 2))
+    normals = np.empty((len(polygons), maxCount, 2))
+
+    for (i, poly) in enumerate(polygons):
+        count = counts[i]
+        points[i, :count] = poly.getTransformedArray()
+        points[i, count:] = points[i, count - 1]
+        normals[i, :count] = poly.getEdgeNormalArray()
+        normals[i, count:] = normals[i, count - 1]
+
+    return (points, normals, counts)
+
+class PairCache:
+    """ Stores one entry per ordered pair of polygons, for things that carry over from one frame to the next. Entries are keyed on the polygons themselves, so evict pairs once the broad phase stops reporting them or the cache will keep them alive. """
+    def __init__(self):
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, polyA, polyB):
+        return self.entries.get((polyA, polyB))
+
+    def store(self, polyA, polyB, entry):
+        self.entries[(polyA, polyB)] = entry
+
+    def evict(self, polyA, polyB):
+        self.entries.pop((polyA, polyB), None)
+        self.entries.pop((polyB, polyA), None)
+
+    def evictPairs(self, pairs):
+        """Evicts a list of pairs, e.g. the removed pairs returned by SweepAndPrune.update"""
+        for (polyA, polyB) in pairs:
+            self.evict(polyA, polyB)
+
+    def retain(self, pairs):
+        """Evicts everything except the given pairs, for broad phases that only give us the current pair list"""
+        keep = set()
+        for (polyA, polyB) in pairs:
+            keep.add((polyA, polyB))
+            keep.add((polyB, polyA))
+        self.entries = {key: value for (key, value) in self.entries.items() if key in keep}
 
 def support(polyA, polyB, normal):
-    return polyB.getFurthestPoint(normal) - polyA.getFurthestPoint(-1.0 * normal)
+    (xB, yB) = polyB.getFurthestCoordinates(normal.x, normal.y)
+    (xA, yA) = polyA.getFurthestCoordinates(-normal.x, -normal.y)
+    return Vector(xB - xA, yB - yA)
 
 def getCrossProduct(p1, p2):
     return [p1[1] * p2[2] - p1[2] * p2[1], -(p1[0] * p2[2] - p1[2] * p2[0]), p1[0] * p2[1] - p1[1] * p2[0]]
@@ -127,16 +687,11 @@ def getTripleProduct(a, b, c):
     return b * (a.dot(c)) - a * (c.dot(b))
 
 def isPointInTriangle(p, a, b, c):
-    ab = b - a
-    bc = c - b
-    ca = a - c
-    ap = p - a
-    bp = p - b
-    cp = p - c
-
-    abap = getCrossProduct(ab.asList3(), ap.asList3())[2]
-    bcbp = getCrossProduct(bc.asList3(), bp.asList3())[2]
-    cacp = getCrossProduct(ca.asList3(), cp.asList3())[2]
+    #The z component of the cross product of each edge with the point relative to the edge's start, worked out on the
+    #coordinates so no vectors or lists get made. The point is inside if they all have the same sign
+    abap = (b.x - a.x) * (p.y - a.y) - (b.y - a.y) * (p.x - a.x)
+    bcbp = (c.x - b.x) * (p.y - b.y) - (c.y - b.y) * (p.x - b.x)
+    cacp = (a.x - c.x) * (p.y - c.y) - (a.y - c.y) * (p.x - c.x)
 
     if(abap >= 0 and bcbp >= 0 and cacp >= 0):
         return True
@@ -145,13 +700,9 @@ def isPointInTriangle(p, a, b, c):
     else:
         return False
 
-def drawPolygon(screen, poly, color=(255, 255, 255)):
-    (points, centroid_ws) = poly.getTransformedPoints()
-    pygame.draw.polygon(screen, color, [point.asList2() for point in points], 3)
-    drawCircle(screen, centroid_ws, 3)
-
-def drawLine(screen, start, end, color=(0, 255, 0)):
-    pygame.draw.line(screen, color, start.asList2(), end.asList2(), 2)
-
-def drawCircle(screen, origin, radius, color=(255, 255, 0)):
-    pygame.draw.circle(screen, color, origin.asList2(), radius, 0)
\ No newline at end of file
+def __getattr__(name):
+    #The drawing helpers used to live here, they're loaded on demand so importing the maths doesn't import pygame
+    if name in ('drawPolygon', 'drawLine', 'drawCircle'):
+        from utils import rendering
+        return getattr(rendering, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))